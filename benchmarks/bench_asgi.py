@@ -0,0 +1,106 @@
+"""
+Drive config.asgi in-process with many concurrent /mygraph/ and /predict/
+reads on one event loop, and report the throughput and the threads used.
+Needs the environment the server needs (DATABASE_URL, REDDIT_*) and a
+ticker whose predictions are stored.
+
+usage: python benchmarks/bench_asgi.py [--ticker aal] [--concurrency 1 16 128]
+                                       [--requests 1000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.local")
+from config.asgi import application  # noqa: E402
+
+
+async def post(path, body):
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "query_string": b"",
+        "http_version": "1.1",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+        ],
+    }
+    status = []
+    received = []
+
+    async def receive():
+        if received:
+            await asyncio.Event().wait()
+        received.append(body)
+        return {"type": "http.request", "body": body}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    start = time.perf_counter()
+    await application(scope, receive, send)
+    assert status == [200], status
+    return time.perf_counter() - start
+
+
+async def load(ticker, concurrency, requests):
+    dates = pd.date_range("2016-05-26", "2016-06-15").strftime("%Y-%m-%d")
+    calls = []
+    for i in range(requests):
+        if i % 2:
+            calls.append(("/twitter_stock/mygraph/", "ticker={}".format(ticker)))
+        else:
+            day = dates[i % len(dates)]
+            calls.append(
+                ("/twitter_stock/predict/", "ticker={}&myDate={}".format(ticker, day))
+            )
+    limit = asyncio.Semaphore(concurrency)
+    threads = [threading.active_count()]
+
+    async def call(path, body):
+        async with limit:
+            threads.append(threading.active_count())
+            return await post(path, body.encode())
+
+    start = time.perf_counter()
+    times = await asyncio.gather(*(call(*c) for c in calls))
+    rate = requests / (time.perf_counter() - start)
+    return rate, np.percentile(times, [50, 99]), max(threads)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticker", default="aal")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--requests", type=int, default=1000)
+    args = parser.parse_args()
+
+    asyncio.run(load(args.ticker, 1, 50))
+    print(
+        "{:>13}{:>10}{:>10}{:>10}{:>9}".format(
+            "concurrency", "req/s", "p50", "p99", "threads"
+        )
+    )
+    for concurrency in args.concurrency:
+        rate, (p50, p99), threads = asyncio.run(
+            load(args.ticker, concurrency, args.requests)
+        )
+        print(
+            "{:>13}{:>10.0f}{:>8.1f}ms{:>8.1f}ms{:>9}".format(
+                concurrency, rate, p50 * 1000, p99 * 1000, threads
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
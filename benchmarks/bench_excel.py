@@ -0,0 +1,108 @@
+"""
+Benchmark converting a Twitter dashboard export to parquet with
+pd.read_excel against the streaming converter. Each converter runs in a
+fresh process so peak RSS is comparable.
+
+usage: python benchmarks/bench_excel.py [export.xlsx] [--rows N]
+                                        [--row-group-size N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import xlsxwriter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.excel import excel_to_parquet  # noqa: E402
+
+
+def read_excel(src, dst, row_group_size):
+    """
+    The converter UploadTwitterData uses by default
+    """
+    tmp = pd.read_excel(src, sheet_name="Stream", parse_dates=["Date"])
+    tmp.to_parquet(dst)
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(converter, src, dst, row_group_size):
+    before = peak_rss()
+    start = time.perf_counter()
+    converter(src, dst, row_group_size=row_group_size)
+    return time.perf_counter() - start, peak_rss() - before
+
+
+def sample_export(path, rows):
+    """
+    Export with the columns of a dashboard "Stream" sheet
+    """
+    book = xlsxwriter.Workbook(path, {"constant_memory": True})
+    sheet = book.add_worksheet("Stream")
+    header = ["Tweet Id", "Date", "Hour", "User Name", "Tweet content"]
+    header += ["Favs", "RTs", "Followers", "Following", "Is a RT", "Country"]
+    sheet.write_row(0, 0, header)
+    for i in range(1, rows + 1):
+        sheet.write_row(
+            i,
+            0,
+            [
+                str(720000000000000000 + i),
+                "2016-{:02d}-{:02d}".format(3 + i % 4, 1 + i % 28),
+                "{:02d}:{:02d}".format(i % 24, i % 60),
+                "user{}".format(i % 5000),
+                "$AAPL is going to the moon, buy buy buy! #{}".format(i),
+                i % 50,
+                i % 20,
+                (i * 37) % 100000 if i % 11 else "",
+                (i * 13) % 5000,
+                bool(i % 3),
+                "US",
+            ],
+        )
+    book.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("xlsx", nargs="?")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--row-group-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = args.xlsx
+        if src is None:
+            src = os.path.join(tmp, "export_dashboard_aapl.xlsx")
+            sample_export(src, args.rows)
+        spawn = multiprocessing.get_context("spawn")
+        out = {}
+        for label, converter in (
+            ("read_excel", read_excel),
+            ("streaming", excel_to_parquet),
+        ):
+            out[label] = os.path.join(tmp, label + ".parquet")
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                elapsed, rss = pool.submit(
+                    timed, converter, src, out[label], args.row_group_size
+                ).result()
+            print(
+                "{:<12}{:.1f}s  peak RSS +{:.0f} MiB".format(label + ":", elapsed, rss)
+            )
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(out["read_excel"]), pd.read_parquet(out["streaming"])
+        )
+        print("outputs match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark converting many Twitter dashboard exports to parquet: one at a
+time through openpyxl, as UploadTwitterData used to, against a process pool
+with the fastest installed excel engine, as UploadAllTwitterData does.
+
+usage: python benchmarks/bench_exports.py [--files N] [--rows N] [--workers N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_excel import sample_export  # noqa: E402
+from twitter_stock.utils.excel import convert_export, excel_engine  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        srcs = []
+        for i in range(args.files):
+            srcs.append(os.path.join(tmp, "export_dashboard_t{}.xlsx".format(i)))
+            sample_export(srcs[-1], args.rows)
+
+        start = time.perf_counter()
+        for src in srcs:
+            convert_export(src, src + ".openpyxl.parquet", engine="openpyxl")
+        print(
+            "{:<28}{:.1f}s".format("sequential openpyxl:", time.perf_counter() - start)
+        )
+
+        engine = excel_engine()
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            args.workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            timings = list(
+                pool.map(
+                    convert_export,
+                    srcs,
+                    [src + ".pool.parquet" for src in srcs],
+                    [engine] * len(srcs),
+                )
+            )
+        label = "{} x {} workers:".format(engine, args.workers)
+        print("{:<28}{:.1f}s".format(label, time.perf_counter() - start))
+        print("per file: " + ", ".join("{:.2f}s".format(t) for t in timings))
+        for src in srcs:
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(src + ".openpyxl.parquet"),
+                pd.read_parquet(src + ".pool.parquet"),
+            )
+        print("outputs match")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark cleaning many tickers one ExtracttoDB at a time against one dask
+graph over all tickers.
+
+usage: python benchmarks/bench_graph.py finance.parquet twitter.parquet
+                                        [--tickers N] [--schedulers threads processes]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.clean import compute_graph, twitter_finance  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("finance")
+    parser.add_argument("twitter")
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument(
+        "--schedulers", nargs="*", default=["threads", "processes", "distributed"]
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # one copy of the inputs per ticker, as in data/FinanceData etc.
+        files = {}
+        for i in range(args.tickers):
+            finance = os.path.join(tmp, "f{}.parquet".format(i))
+            twitter = os.path.join(tmp, "t{}.parquet".format(i))
+            shutil.copy(args.finance, finance)
+            shutil.copy(args.twitter, twitter)
+            files["t{}".format(i)] = (finance, twitter)
+
+        start = time.perf_counter()
+        for finance, twitter in files.values():
+            compute_graph(twitter_finance(finance, twitter))
+        serial = time.perf_counter() - start
+        print("tickers:              {}".format(args.tickers))
+        print("one ticker at a time: {:.2f}s".format(serial))
+
+        for scheduler in args.schedulers:
+            graph = {t: twitter_finance(f, tw) for t, (f, tw) in files.items()}
+            start = time.perf_counter()
+            compute_graph(graph, scheduler)
+            elapsed = time.perf_counter() - start
+            print(
+                "{:<22}{:.2f}s ({:.1f}x)".format(
+                    "one graph, " + scheduler + ":", elapsed, serial / elapsed
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark the model artifact cache: train the models of synthetic tickers
+twice through a fresh ModelCache, and report per ticker the fit and load
+times, the artifact size on disk and the hit or miss of each pass.
+
+usage: python benchmarks/bench_model_cache.py [--tickers 10] [--days 78]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.train import (  # noqa: E402
+    PREDICT_WINDOW,
+    ModelCache,
+    train_many,
+)
+
+
+def cleaned(seed, days):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range(end=PREDICT_WINDOW[1], periods=days),
+            "sentiment": rng.randn(days),
+            "pct_change": rng.randn(days) / 100,
+            "signal": rng.randint(0, 2, days),
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=10)
+    parser.add_argument("--days", type=int, default=78)
+    args = parser.parse_args()
+
+    frames = {"t{}".format(i): cleaned(i, args.days) for i in range(args.tickers)}
+    with tempfile.TemporaryDirectory() as tmp:
+        passes = []
+        for _ in range(2):
+            cache = ModelCache(tmp)
+            start = time.perf_counter()
+            train_many(frames, workers=1, n_jobs=1, cache=cache)
+            passes.append((cache.report, time.perf_counter() - start))
+
+    print(
+        "{:>8}{:>8}{:>12}{:>8}{:>12}{:>10}".format(
+            "ticker", "first", "fit", "second", "load", "size"
+        )
+    )
+    (first, first_total), (second, second_total) = passes
+    for ticker in frames:
+        print(
+            "{:>8}{:>8}{:>10.1f}ms{:>8}{:>10.1f}ms{:>8.0f}KB".format(
+                ticker,
+                "hit" if first[ticker][0] else "miss",
+                first[ticker][1] * 1000,
+                "hit" if second[ticker][0] else "miss",
+                second[ticker][1] * 1000,
+                second[ticker][2] / 1024,
+            )
+        )
+    print(
+        "total: first pass {:.2f}s, second pass {:.2f}s".format(
+            first_total, second_total
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
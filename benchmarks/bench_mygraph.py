@@ -0,0 +1,132 @@
+"""
+Benchmark the /mygraph/ payload as the prediction history grows: computed
+per request from the {ticker}_predict table against the single keyed read
+of the curves Analyze materializes, then the bytes (raw and gzipped) and
+server time of the full and downsampled payloads in each format.
+
+usage: python benchmarks/bench_mygraph.py [--years 1 5 20] [--repeat N]
+                                          [--points 1000]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.db import get_engine  # noqa: E402
+from twitter_stock.utils.db_target import TickerTable  # noqa: E402
+from twitter_stock.utils.graph import (  # noqa: E402
+    graph,
+    graph_json,
+    encode_curves,
+    graph_payload,
+    nav_curves,
+    store_curves,
+)
+
+
+def per_request(ticker):
+    """
+    What /mygraph/ did before
+    """
+    date, nav, nav_strategy = graph(ticker)
+    return json.dumps({"date": date, "nav": nav, "nav_strategy": nav_strategy})
+
+
+def history(days):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2000-01-01", periods=days),
+            "pct_change": rng.randn(days) / 100,
+            "signal_predict": rng.randint(0, 2, days),
+        }
+    )
+
+
+def percentiles_ms(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return np.percentile(times, [50, 99]) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--points", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.sqlite3")
+        engine = get_engine()
+        print(
+            "{:>6}{:>8}{:>14}{:>14}{:>14}{:>14}".format(
+                "years", "rows", "before p50", "before p99", "after p50", "after p99"
+            )
+        )
+        for years in args.years:
+            ticker = "t{}".format(years)
+            data = history(years * 365)
+            with engine.begin() as con:
+                TickerTable(ticker, engine, "_predict", long=False).write(con, data)
+                store_curves(con, ticker, nav_curves(data))
+            assert per_request(ticker) == graph_json(ticker)
+            before = percentiles_ms(lambda: per_request(ticker), args.repeat)
+            after = percentiles_ms(lambda: graph_json(ticker), args.repeat)
+            print(
+                "{:>6}{:>8}{:>12.2f}ms{:>12.2f}ms{:>12.2f}ms{:>12.2f}ms".format(
+                    years, len(data), *before, *after
+                )
+            )
+
+        print(
+            "\n{:>6}{:>8}{:>8}{:>10}{:>10}{:>12}{:>12}".format(
+                "years",
+                "format",
+                "points",
+                "bytes",
+                "gzipped",
+                "uncached",
+                "server p50",
+            )
+        )
+        for years in args.years:
+            ticker = "t{}".format(years)
+            for format in ("json", "binary"):
+                for points in (None, args.points):
+                    # the first read of the curves downsamples them
+                    encode_curves.cache_clear()
+                    start = time.perf_counter()
+                    payload, _ = graph_payload(ticker, points, format)
+                    uncached = (time.perf_counter() - start) * 1000
+                    if isinstance(payload, str):
+                        payload = payload.encode()
+                    p50, _ = percentiles_ms(
+                        lambda: graph_payload(ticker, points, format), args.repeat
+                    )
+                    print(
+                        "{:>6}{:>8}{:>8}{:>10}{:>10}{:>10.2f}ms{:>10.2f}ms".format(
+                            years,
+                            format,
+                            points or "all",
+                            len(payload),
+                            # the level of django.views.decorators.gzip
+                            len(gzip.compress(payload, 6)),
+                            uncached,
+                            p50,
+                        )
+                    )
+
+
+if __name__ == "__main__":
+    main()
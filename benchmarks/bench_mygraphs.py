@@ -0,0 +1,99 @@
+"""
+Benchmark comparing many tickers: N /mygraph/ payloads, computed per call or
+read materialized, against one /mygraphs/ payload built in a single pass
+over the (date x ticker) matrix, with per-ticker tables and the long table.
+
+usage: python benchmarks/bench_mygraphs.py [--tickers 5 20 100] [--years 5]
+                                           [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from luigi.configuration import get_config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.db import get_engine  # noqa: E402
+from twitter_stock.utils.db_target import TickerTable  # noqa: E402
+from twitter_stock.utils.graph import (  # noqa: E402
+    batch_json,
+    graph,
+    graph_json,
+    nav_curves,
+    store_curves,
+)
+
+
+def history(seed, days):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2000-01-01", periods=days),
+            "pct_change": rng.randn(days) / 100,
+            "signal_predict": rng.randint(0, 2, days),
+        }
+    )
+
+
+def computed(ticker):
+    """
+    What N /mygraph/ calls did before the curves were materialized
+    """
+    date, nav, nav_strategy = graph(ticker)
+    return json.dumps({"date": date, "nav": nav, "nav_strategy": nav_strategy})
+
+
+def median_ms(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.sqlite3")
+        engine = get_engine()
+        tickers = ["t{}".format(i) for i in range(max(args.tickers))]
+        for long in (False, True):
+            with engine.begin() as con:
+                for i, ticker in enumerate(tickers):
+                    data = history(i, args.years * 365)
+                    TickerTable(ticker, engine, "_predict", long=long).write(con, data)
+                    store_curves(con, ticker, nav_curves(data))
+
+        print(
+            "{:>8}{:>8}{:>14}{:>16}{:>10}".format(
+                "storage", "tickers", "N computed", "N materialized", "batch"
+            )
+        )
+        for long in (False, True):
+            get_config().set("storage", "long_table", str(long).lower())
+            for n in args.tickers:
+                some = tickers[:n]
+                print(
+                    "{:>8}{:>8}{:>12.1f}ms{:>14.1f}ms{:>8.1f}ms".format(
+                        "long" if long else "ticker",
+                        n,
+                        median_ms(lambda: [computed(t) for t in some], args.repeat),
+                        median_ms(lambda: [graph_json(t) for t in some], args.repeat),
+                        median_ms(lambda: batch_json(some), args.repeat),
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
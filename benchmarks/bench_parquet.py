@@ -0,0 +1,91 @@
+"""
+Benchmark reading a Twitter export with and without parquet predicate
+pushdown. Each reader runs in a fresh process so peak RSS is comparable.
+
+usage: python benchmarks/bench_parquet.py [twitter.parquet] [--rows N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.clean import TWITTER_WINDOW, read_twitter  # noqa: E402
+
+
+def full_read(file):
+    """
+    The reader clean_twitter used before: read everything, filter in pandas
+    """
+    twitter = pd.read_parquet(file, columns=["Date", "Tweet content", "Followers"])
+    twitter = twitter[
+        (twitter["Date"] >= TWITTER_WINDOW[0]) & (twitter["Date"] <= TWITTER_WINDOW[1])
+    ]
+    return twitter[twitter["Followers"].notnull()]
+
+
+def peak_rss():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(reader, file):
+    before = peak_rss()
+    start = time.perf_counter()
+    rows = len(reader(file))
+    elapsed = time.perf_counter() - start
+    return rows, elapsed, peak_rss() - before
+
+
+def sample_export(path, rows, seed=0):
+    """
+    Two years of tweets sorted by date, as the dashboard exports are
+    """
+    rng = np.random.RandomState(seed)
+    dates = np.sort(
+        pd.Timestamp("2015-06-01").value
+        + rng.randint(0, 2 * 365 * 86400, rows).astype("int64") * 10**9
+    )
+    followers = rng.randint(1, 10**6, rows).astype(float)
+    followers[rng.rand(rows) < 0.05] = np.nan
+    pd.DataFrame(
+        {
+            "Date": pd.to_datetime(dates),
+            "Tweet content": ["$AAPL to the moon {}".format(i) for i in range(rows)],
+            "Followers": followers,
+            "Tweet language (ISO 639-1)": "en",
+        }
+    ).to_parquet(path, row_group_size=50000)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parquet", nargs="?")
+    parser.add_argument("--rows", type=int, default=2000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file = args.parquet
+        if file is None:
+            file = os.path.join(tmp, "twitter.parquet")
+            sample_export(file, args.rows)
+        spawn = multiprocessing.get_context("spawn")
+        for label, reader in (("full read", full_read), ("pushdown", read_twitter)):
+            with ProcessPoolExecutor(1, mp_context=spawn) as pool:
+                rows, elapsed, rss = pool.submit(timed, reader, file).result()
+            print(
+                "{:<10} rows {:>9}  {:.2f}s  peak RSS +{:.0f} MiB".format(
+                    label + ":", rows, elapsed, rss
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
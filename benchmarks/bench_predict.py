@@ -0,0 +1,94 @@
+"""
+Benchmark the Predict lookup of one date as the prediction history grows:
+the old unindexed LIKE scan against the indexed range lookup.
+
+usage: python benchmarks/bench_predict.py [--years 1 5 20] [--repeat N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+from twitter_stock.utils.analyze_tasks import Predict  # noqa: E402
+from twitter_stock.utils.db_target import TickerTable  # noqa: E402
+
+
+def like_lookup(engine, ticker, date):
+    """
+    The query Predict ran before
+    """
+    return pd.read_sql_query(
+        '''SELECT date, signal_predict FROM {}_predict WHERE date LIKE "{}%"'''.format(
+            ticker, date
+        ),
+        con=engine,
+        parse_dates=["Date"],
+    )
+
+
+def history(days):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2000-01-01", periods=days),
+            "sentiment": rng.randn(days),
+            "pct_change": rng.randn(days) / 100,
+            "signal": rng.rand(days) > 0.5,
+            "signal_predict": rng.randint(0, 2, days),
+        }
+    )
+
+
+def median_ms(lookup, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        lookup()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5, 20, 80])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine("sqlite:///" + os.path.join(tmp, "bench.sqlite3"))
+        print("{:>8}{:>10}{:>12}{:>12}".format("years", "rows", "LIKE", "indexed"))
+        for years in args.years:
+            data = history(years * 365)
+            like = "old_{}".format(years)
+            data.to_sql(like + "_predict", con=engine, index=False)
+            indexed = "new_{}".format(years)
+            with engine.begin() as con:
+                TickerTable(indexed, engine, "_predict", long=False).write(con, data)
+
+            # look up a day near the end, as the web page does
+            date = str(data["Date"].iloc[-10].date())
+            task = Predict(indexed, date)
+            task.engine = engine
+            pd.testing.assert_frame_equal(
+                like_lookup(engine, like, date).rename(columns={"date": "Date"}),
+                task.lookup(),
+            )
+            print(
+                "{:>8}{:>10}{:>10.2f}ms{:>10.2f}ms".format(
+                    years,
+                    len(data),
+                    median_ms(lambda: like_lookup(engine, like, date), args.repeat),
+                    median_ms(task.lookup, args.repeat),
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark predictions of many tickers over a date range: one /predict/
+lookup per (ticker, date) against one batch read per storage partition,
+with per-ticker tables and the long table.
+
+usage: python benchmarks/bench_predictions.py [--tickers 100] [--days 30]
+                                              [--years 5] [--repeat N]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from luigi.configuration import get_config
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.sqlite3")
+from twitter_stock.utils.analyze_tasks import (  # noqa: E402
+    Predict,
+    get_prediction,
+    predictions_json,
+)
+from twitter_stock.utils.db_target import TickerTable  # noqa: E402
+from twitter_stock.utils.results import ResultStore  # noqa: E402
+
+
+def history(seed, days):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range("2000-01-01", periods=days),
+            "sentiment": rng.randn(days),
+            "pct_change": rng.randn(days) / 100,
+            "signal": rng.rand(days) > 0.5,
+            "signal_predict": rng.randint(0, 2, days),
+        }
+    )
+
+
+def single_lookups(tickers, days):
+    # a cold result store, so every pair is looked up
+    Predict.results = ResultStore()
+    return [get_prediction(ticker, day) for ticker in tickers for day in days]
+
+
+def median_ms(call, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return np.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = Predict.engine
+    tickers = ["t{}".format(i) for i in range(args.tickers)]
+    rows = args.years * 365
+    for long in (False, True):
+        with engine.begin() as con:
+            for i, ticker in enumerate(tickers):
+                TickerTable(ticker, engine, "_predict", long=long).write(
+                    con, history(i, rows)
+                )
+    # the last days of the history
+    end = pd.Timestamp("2000-01-01") + pd.Timedelta(days=rows - 1)
+    days = pd.date_range(end=end, periods=args.days).strftime("%Y-%m-%d")
+
+    print(
+        "{:>8}{:>8}{:>6}{:>16}{:>10}".format(
+            "storage", "tickers", "days", "lookup per pair", "batch"
+        )
+    )
+    for long in (False, True):
+        get_config().set("storage", "long_table", str(long).lower())
+        print(
+            "{:>8}{:>8}{:>6}{:>14.1f}ms{:>8.1f}ms".format(
+                "long" if long else "ticker",
+                args.tickers,
+                args.days,
+                median_ms(lambda: single_lookups(tickers, days), args.repeat),
+                median_ms(
+                    lambda: predictions_json(tickers, days[0], days[-1]), args.repeat
+                ),
+            )
+        )
+    shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark batch VADER scoring against the per-row polarity_scores path.
+
+Also times the on-disk score cache cold, warm, and after 1% new tweets,
+and the process-pool mode for each --workers count.
+
+usage: python benchmarks/bench_sentiment.py [twitter.parquet] [--rows N]
+                                            [--workers 1 2 4] [--chunk-size N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.sentiment import (  # noqa: E402
+    BatchSentimentAnalyzer,
+    compound_scores,
+    parallel_compound,
+)
+
+
+def sample_tweets(rows, seed=0):
+    """
+    Synthetic tweets built from lexicon, booster and negation words
+    """
+    rng = np.random.RandomState(seed)
+    words = [
+        "$AAPL", "stock", "is", "the", "not", "very", "good", "bad", "great",
+        "but", "never", "so", "crash", "moon", "LOVE", "hate", "kind", "of",
+        "least", "no", "sux", "lol", ":)", ":(", "!!!", "??",
+    ]  # fmt: skip
+    lengths = rng.randint(3, 20, rows)
+    return pd.Series([" ".join(rng.choice(words, k)) for k in lengths])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("parquet", nargs="?")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--workers", type=int, nargs="*", default=[])
+    parser.add_argument("--chunk-size", type=int, default=20000)
+    args = parser.parse_args()
+    if args.parquet:
+        texts = pd.read_parquet(args.parquet, columns=["Tweet content"])
+        texts = texts["Tweet content"].dropna().head(args.rows)
+    else:
+        texts = sample_tweets(args.rows)
+
+    analyzer = SentimentIntensityAnalyzer()
+    start = time.perf_counter()
+    per_row = texts.apply(lambda x: analyzer.polarity_scores(x)["compound"])
+    row_time = time.perf_counter() - start
+
+    batch = BatchSentimentAnalyzer(analyzer)
+    start = time.perf_counter()
+    scores = batch.compound(texts)
+    batch_time = time.perf_counter() - start
+
+    print("rows:          {}".format(len(texts)))
+    print("per-row apply: {:.3f}s".format(row_time))
+    print("batch:         {:.3f}s ({:.1f}x)".format(batch_time, row_time / batch_time))
+    print("max abs diff:  {:.2e}".format(np.abs(per_row.to_numpy() - scores).max()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite3")
+        refreshed = pd.concat([texts, sample_tweets(max(len(texts) // 100, 1), 1)])
+        for label, column in (
+            ("cache cold", texts),
+            ("cache warm", texts),
+            ("cache +1% new", refreshed),
+        ):
+            start = time.perf_counter()
+            compound_scores(column, path)
+            print("{:<15}{:.3f}s".format(label + ":", time.perf_counter() - start))
+
+    for workers in args.workers:
+        start = time.perf_counter()
+        parallel = parallel_compound(texts, workers, args.chunk_size)
+        elapsed = time.perf_counter() - start
+        assert np.array_equal(parallel, scores)
+        label = "{} workers:".format(workers)
+        print(
+            "{:<15}{:.3f}s ({:.0f} tweets/s)".format(
+                label, elapsed, len(texts) / elapsed
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
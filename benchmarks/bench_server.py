@@ -0,0 +1,134 @@
+"""
+Load test of /predict/ and /mygraph/ against the WSGI application served
+one request at a time (--nothreading), threaded, and by several processes.
+Needs the environment the server needs (DATABASE_URL, REDDIT_*) and a
+ticker whose predictions are stored.
+
+usage: python benchmarks/bench_server.py [--ticker aal] [--processes 1 2 4]
+                                         [--concurrency 1 8 32] [--requests 400]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def serve(port, threaded):
+    """
+    Serve config.wsgi the way runserver does
+    """
+    os.chdir(ROOT)
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings.local")
+    from django.core.servers.basehttp import run
+    from config.wsgi import application
+
+    run("127.0.0.1", port, application, threading=threaded)
+
+
+def post(url, data, check=False):
+    """
+    Seconds the request took, None if the server refused or dropped it
+    """
+    start = time.perf_counter()
+    body = urllib.parse.urlencode(data).encode()
+    try:
+        with urllib.request.urlopen(url, body) as response:
+            response.read()
+    except urllib.error.HTTPError:
+        raise
+    except OSError:
+        if check:
+            raise
+        return None
+    return time.perf_counter() - start
+
+
+def load(ports, ticker, concurrency, requests, check=False):
+    """
+    Alternate predictions of every date and graphs, spread over the servers.
+    Return the rate of answered requests, their p50 and p99 and the errors
+    """
+    dates = pd.date_range("2016-05-26", "2016-06-15").strftime("%Y-%m-%d")
+    calls = []
+    for i in range(requests):
+        url = "http://127.0.0.1:{}/twitter_stock/".format(ports[i % len(ports)])
+        if i % 2:
+            calls.append((url + "mygraph/", {"ticker": ticker}))
+        else:
+            calls.append(
+                (url + "predict/", {"ticker": ticker, "myDate": dates[i % len(dates)]})
+            )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        times = list(pool.map(lambda call: post(*call, check), calls))
+    elapsed = time.perf_counter() - start
+    answered = [t for t in times if t is not None]
+    return (
+        len(answered) / elapsed,
+        np.percentile(answered, [50, 99]),
+        len(times) - len(answered),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ticker", default="aal")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    setups = [("nothreading", 1, False)] + [
+        ("threaded x{}".format(n), n, True) for n in args.processes
+    ]
+    print(
+        "{:>16}{:>13}{:>10}{:>10}{:>10}{:>8}".format(
+            "server", "concurrency", "req/s", "p50", "p99", "errors"
+        )
+    )
+    for name, processes, threaded in setups:
+        ports = [args.port + i for i in range(processes)]
+        servers = [context.Process(target=serve, args=(p, threaded)) for p in ports]
+        for server in servers:
+            server.start()
+        try:
+            # wait for the servers and warm them up
+            for _ in range(600):
+                try:
+                    load(ports, args.ticker, 1, 2 * len(ports), check=True)
+                    break
+                except urllib.error.HTTPError:
+                    raise
+                except OSError:
+                    time.sleep(0.1)
+            for concurrency in args.concurrency:
+                rate, (p50, p99), errors = load(
+                    ports, args.ticker, concurrency, args.requests
+                )
+                print(
+                    "{:>16}{:>13}{:>10.0f}{:>8.1f}ms{:>8.1f}ms{:>8}".format(
+                        name, concurrency, rate, p50 * 1000, p99 * 1000, errors
+                    )
+                )
+        finally:
+            for server in servers:
+                server.terminate()
+                server.join()
+        args.port += processes
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark training the models of many tickers (TrainAll) per configuration
+of worker processes x trees fitted per process, on synthetic cleaned data,
+and report the total wall-clock of each.
+
+usage: python benchmarks/bench_training.py [--tickers 100] [--days 78]
+                                           [--configs 1x1 1x4 4x1 2x2 0x0]
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from twitter_stock.utils.train import (  # noqa: E402
+    PREDICT_WINDOW,
+    balance_workers,
+    train_many,
+)
+
+
+def cleaned(seed, days):
+    """
+    Cleaned data of a ticker ending with the predict window, as ExtracttoDB
+    stores it
+    """
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame(
+        {
+            "Date": pd.date_range(end=PREDICT_WINDOW[1], periods=days),
+            "sentiment": rng.randn(days),
+            "pct_change": rng.randn(days) / 100,
+            "signal": rng.randint(0, 2, days),
+        }
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickers", type=int, default=100)
+    parser.add_argument("--days", type=int, default=78)
+    # workers x n_jobs, 0 balanced against the cores
+    parser.add_argument(
+        "--configs", nargs="+", default=["1x1", "1x4", "4x1", "2x2", "0x0"]
+    )
+    args = parser.parse_args()
+
+    frames = {"t{}".format(i): cleaned(i, args.days) for i in range(args.tickers)}
+    print(
+        "{} cores, {} tickers of {} days".format(
+            os.cpu_count(), args.tickers, args.days
+        )
+    )
+    print(
+        "{:>10}{:>10}{:>10}{:>12}".format("config", "workers", "n_jobs", "wall-clock")
+    )
+    for config in args.configs:
+        workers, n_jobs = (int(n) for n in config.split("x"))
+        balanced = balance_workers(len(frames), workers, n_jobs)
+        start = time.perf_counter()
+        train_many(frames, workers, n_jobs)
+        print(
+            "{:>10}{:>10}{:>10}{:>11.2f}s".format(
+                config, *balanced, time.perf_counter() - start
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+ASGI config for final project.
+
+This module exposes a module-level ASGI callable named ``application``. Every
+request is served by the WSGI application of ``config.wsgi``, so middleware,
+the request signals and the conversion of exceptions to error responses all
+apply, in a thread pool off the event loop. The read-only views of
+``twitter_stock.utils.async_request``, found with the URLconf, run in their
+own bounded pool, so a burst of graph and prediction reads does not hold
+the threads of the other requests. Streams stop at the client's disconnect,
+so an abandoned job event stream gives its thread back. Django 2.2 has no
+ASGI handler, hence the small bridge below. Serve it with any ASGI server, e.g.
+
+    uvicorn config.asgi:application --workers 4
+
+"""
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.urls import Resolver404, resolve
+
+from config.wsgi import application as wsgi_application
+from twitter_stock.utils.async_request import executor as read_executor, read_views
+
+# threads for every other request, streams included
+wsgi_executor = ThreadPoolExecutor(
+    int(os.environ.get("ASGI_WSGI_THREADS", 16)), thread_name_prefix="wsgi"
+)
+
+
+def wsgi_environ(scope, body):
+    """
+    WSGI environ of an ASGI http scope
+    """
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": "HTTP/{}".format(scope["http_version"]),
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        environ[name] = environ[name] + "," + value if name in environ else value
+    # the body is read whole, chunked requests included
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def encode_headers(headers):
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in headers
+    ]
+
+
+def executor_for(path):
+    """
+    Thread pool serving path: the read pool for the read-only views
+    """
+    try:
+        view = resolve(path).func
+    except Resolver404:
+        return wsgi_executor
+    return read_executor if view in read_views else wsgi_executor
+
+
+async def disconnected(receive):
+    """
+    Wait for the client to go away; the body has been read already
+    """
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def call_wsgi(environ, receive, send, executor):
+    """
+    Serve the request by the WSGI application in executor, chunk by chunk so
+    streaming responses stream, until the client disconnects
+    """
+    loop = asyncio.get_running_loop()
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"], started["headers"] = int(status.split(" ")[0]), headers
+
+    result = await loop.run_in_executor(
+        executor, wsgi_application, environ, start_response
+    )
+    gone = asyncio.ensure_future(disconnected(receive))
+    try:
+        chunks = iter(result)
+        chunk = await loop.run_in_executor(executor, next, chunks, None)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": started["status"],
+                "headers": encode_headers(started["headers"]),
+            }
+        )
+        while chunk is not None:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            pending = loop.run_in_executor(executor, next, chunks, None)
+            await asyncio.wait({pending, gone}, return_when=asyncio.FIRST_COMPLETED)
+            # an abandoned stream (job events) is closed at its next chunk,
+            # not left holding a thread until it ends
+            chunk = None if gone.done() else pending.result()
+            if chunk is None:
+                await pending
+        if not gone.done():
+            await send({"type": "http.response.body", "body": b""})
+    finally:
+        gone.cancel()
+        if hasattr(result, "close"):
+            await loop.run_in_executor(executor, result.close)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            await send({"type": message["type"] + ".complete"})
+            if message["type"] == "lifespan.shutdown":
+                return
+    body = await read_body(receive)
+    await call_wsgi(
+        wsgi_environ(scope, body), receive, send, executor_for(scope["path"])
+    )
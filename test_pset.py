@@ -1,13 +1,50 @@
 from unittest import TestCase
 from django.test import TestCase as DJTest, RequestFactory
 from tempfile import TemporaryDirectory
+from unittest.mock import Mock, patch
+import asyncio
+import gzip
 import boto3
 import pytest
 import xlsxwriter
 from moto import mock_s3
 from twitter_stock.utils.analyze_tasks import *
 from twitter_stock.utils.my_request import *
+from twitter_stock.utils.sentiment import (
+    BatchSentimentAnalyzer,
+    compound_scores,
+    parallel_compound,
+)
+from twitter_stock.utils.db import get_engine, pool_metrics
+from twitter_stock.utils.db_target import Catalog
+from twitter_stock.utils.fingerprint import file_fingerprint
+from twitter_stock.utils.score_cache import SentimentCache, text_hash
+from twitter_stock.utils.results import ResultStore
+from twitter_stock.utils.train import (
+    ModelCache,
+    balance_workers,
+    train_many,
+    train_predict,
+)
+from twitter_stock.utils.jobs import JobQueue, get_jobs
+from twitter_stock.utils.graph import (
+    batch_curves,
+    curves_json,
+    lttb,
+    nav_curves,
+    predict_curves,
+    read_curves,
+)
+from config.asgi import application as asgi_application
+from twitter_stock.utils.excel import excel_to_parquet, export_files, read_sheet
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import request_finished
 from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from luigi import build
+from luigi.configuration import get_config
 
 
 mockBucket = "mockBucket"
@@ -33,6 +70,8 @@ class MockFinance(Task):
 
 class MockExtracttoDB(ExtracttoDB):
     engine = create_engine("sqlite:///django.db.backends.sqlite3")
+    # no scores in data/sentiment_cache.sqlite3
+    sentiment_cache = None
 
     def requires(self):
         return {
@@ -41,11 +80,127 @@ class MockExtracttoDB(ExtracttoDB):
         }
 
 
-class MockAnalyze(Analyze):
+class MockFinanceFile(Task):
+    file = Parameter()
+
+    def output(self):
+        return LocalTarget(self.file)
+
+
+class MockIncrementalExtracttoDB(MockExtracttoDB):
+    finance = Parameter(default="data/FinanceData/aal.parquet")
+
+    def requires(self):
+        return {"twitter": MockTwittwer(), "finance": MockFinanceFile(self.finance)}
+
+
+class MockExtractAlltoDB(ExtractAlltoDB):
     engine = create_engine("sqlite:///django.db.backends.sqlite3")
+    sentiment_cache = None
+
+    def requires(self):
+        return {
+            ticker: {"twitter": MockTwittwer(), "finance": MockFinance()}
+            for ticker in self.tickers
+        }
+
 
+class MockFilesExtractAlltoDB(MockExtractAlltoDB):
+    root = Parameter()
+
+    def requires(self):
+        return {
+            ticker: {
+                "twitter": MockTwittwer(),
+                "finance": MockFinanceFile(
+                    os.path.join(self.root, "{}.parquet".format(ticker))
+                ),
+            }
+            for ticker in self.tickers
+        }
+
+
+class MockJob(Task):
+    path = Parameter()
+    # paths of the jobs that succeeded, as seen by the submitting process
+    succeeded = []
+
+    def output(self):
+        return LocalTarget(self.path)
+
+    def run(self):
+        with self.output().open("w") as f:
+            f.write("done")
+
+    def after_job(self):
+        MockJob.succeeded.append(self.path)
+
+
+class MockChainJob(MockJob):
     def requires(self):
-        return MockExtracttoDB(self.ticker)
+        return [MockJob(self.path + ".a"), MockJob(self.path + ".b")]
+
+
+class MockTableJob(Task):
+    url = Parameter()
+    table = Parameter()
+
+    def output(self):
+        return SQLiteTableTarget(self.table, get_engine(self.url))
+
+    def run(self):
+        pd.DataFrame({"a": [1]}).to_sql(
+            self.table, con=get_engine(self.url), index=False
+        )
+
+
+class MockUploadAllTwitterData(UploadAllTwitterData):
+    root = Parameter()
+
+    def exports(self):
+        files = glob.glob(os.path.join(self.root, "export_dashboard_*.xlsx"))
+        return export_files(files)
+
+    def output(self):
+        return {
+            ticker: LocalTarget(os.path.join(self.root, "{}.parquet".format(ticker)))
+            for ticker in self.exports()
+        }
+
+
+def fixture_prices(tickers, start, end, threads):
+    # stand-in for yahoo: every ticker gets the local aal prices
+    fixture_prices.calls.append(list(tickers))
+    finance = pd.read_parquet("data/FinanceData/aal.parquet").set_index("Date")
+    if len(tickers) == 1:
+        return finance
+    return pd.concat({ticker.upper(): finance for ticker in tickers}, axis=1)
+
+
+class MockUploadAllFinanceData(UploadAllFinanceData):
+    root = Parameter()
+    download = staticmethod(fixture_prices)
+
+    def output(self):
+        return {
+            ticker: LocalTarget(os.path.join(self.root, "{}.parquet".format(ticker)))
+            for ticker in self.tickers
+        }
+
+
+class MockAnalyze(Analyze):
+    engine = create_engine("sqlite:///django.db.backends.sqlite3")
+    extract = MockExtracttoDB
+    # always fit, no artifacts in data/models
+    model_cache = None
+
+
+class MockIncrementalAnalyze(MockAnalyze):
+    extract = MockIncrementalExtracttoDB
+
+
+class MockTrainAll(TrainAll):
+    analyze = MockAnalyze
 
 
 class MockPredict(Predict):
@@ -209,6 +364,106 @@ class CleanDataTest(TestCase):
         self.assertEqual(list(test.columns), ["Date", "sentiment"])
         self.assertEqual(sum(test["sentiment"].isnull()), 0)
 
+    def test_read_twitter_window(self):
+        with TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "twitter.parquet")
+            pd.DataFrame(
+                {
+                    "Date": pd.to_datetime(["2016-01-01", "2016-04-01", "2016-05-01"]),
+                    "Tweet content": ["old", "kept", "no followers"],
+                    "Followers": [10.0, 20.0, None],
+                }
+            ).to_parquet(file, row_group_size=1)
+            test = read_twitter(file)
+            self.assertEqual(list(test["Tweet content"]), ["kept"])
+            test = read_twitter(file, ("2015-12-01", "2016-04-01"))
+            self.assertEqual(list(test["Tweet content"]), ["old", "kept"])
+
+    def test_streaming_excel_to_parquet(self):
+        with TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "export_dashboard_aal_123.xlsx")
+            workbook = xlsxwriter.Workbook(src)
+            worksheet = workbook.add_worksheet("Stream")
+            worksheet.write_row(0, 0, ["Date", "Tweet content", "Followers", "Id"])
+            for i in range(1, 8):
+                followers = "" if i == 3 else (i * 10 if i < 5 else i + 0.5)
+                worksheet.write_row(
+                    i, 0, ["2016-04-0{}".format(i), "tweet", followers, str(i)]
+                )
+            workbook.close()
+
+            expected = os.path.join(tmp, "expected.parquet")
+            pd.read_excel(src, sheet_name="Stream", parse_dates=["Date"]).to_parquet(
+                expected
+            )
+            test = os.path.join(tmp, "test.parquet")
+            excel_to_parquet(src, test, row_group_size=2)
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(test), pd.read_parquet(expected)
+            )
+
+    def test_calamine_reader(self):
+        pytest.importorskip("python_calamine")
+        with TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "export_dashboard_aal_123.xlsx")
+            workbook = xlsxwriter.Workbook(src)
+            worksheet = workbook.add_worksheet("Stream")
+            day = workbook.add_format({"num_format": "yyyy-mm-dd"})
+            stamp = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+            worksheet.write_row(0, 0, ["Date", "Day", "Stamp", "Time", "Followers"])
+            for i in range(1, 4):
+                moment = pd.Timestamp(2016, 4, i, 10, 30)
+                worksheet.write_datetime(i, 0, moment.normalize(), day)
+                worksheet.write_datetime(i, 1, moment.normalize(), day)
+                worksheet.write_datetime(i, 2, moment, stamp)
+                worksheet.write_datetime(i, 3, moment.time(), stamp)
+                worksheet.write_number(i, 4, i * 10.0)
+            workbook.close()
+            pd.testing.assert_frame_equal(
+                read_sheet(src, engine="calamine"), read_sheet(src, engine="openpyxl")
+            )
+
+    def test_export_files(self):
+        files = ["export_dashboard_aal_1.xlsx", "notes.xlsx"]
+        self.assertEqual(export_files(files), {"aal": files[0]})
+        with self.assertRaises(ValueError):
+            export_files(files + ["export_dashboard_AAL_2.xlsx"])
+
+    def test_upload_all_twitter_data(self):
+        with TemporaryDirectory() as tmp:
+            for ticker in ["aal", "aapl"]:
+                src = os.path.join(tmp, "export_dashboard_{}_123.xlsx".format(ticker))
+                workbook = xlsxwriter.Workbook(src)
+                worksheet = workbook.add_worksheet("Stream")
+                worksheet.write_row(0, 0, ["Date", "Tweet content", "Followers"])
+                for i in range(1, 6):
+                    followers = "" if i == 3 else i * 10
+                    worksheet.write_row(
+                        i, 0, ["2016-04-0{}".format(i), ticker, followers]
+                    )
+                workbook.close()
+
+            task = MockUploadAllTwitterData(root=tmp, workers=2)
+            build([task], local_scheduler=True)
+            self.assertEqual(sorted(task.timings), ["aal", "aapl"])
+            for ticker, file in task.exports().items():
+                pd.testing.assert_frame_equal(
+                    pd.read_parquet(task.output()[ticker].path),
+                    pd.read_excel(file, sheet_name="Stream", parse_dates=["Date"]),
+                )
+
+    def test_upload_all_finance_data(self):
+        fixture_prices.calls = []
+        with TemporaryDirectory() as tmp:
+            task = MockUploadAllFinanceData(
+                root=tmp, tickers=["aal", "aapl", "fb"], batch_size=2
+            )
+            self.assertTrue(build([task], local_scheduler=True))
+            self.assertEqual(fixture_prices.calls, [["aal", "aapl"], ["fb"]])
+            expected = pd.read_parquet("data/FinanceData/aal.parquet")
+            for target in task.output().values():
+                pd.testing.assert_frame_equal(pd.read_parquet(target.path), expected)
+
     def test_twitter_finance(self):
         test = dask.compute(
             twitter_finance(
@@ -221,6 +476,71 @@ class CleanDataTest(TestCase):
         )
 
 
+class SentimentTest(TestCase):
+    def test_batch_matches_polarity_scores(self):
+        texts = [
+            "VADER is VERY SMART, uber handsome, and FRIGGIN FUNNY!!!",
+            "VADER is not smart, handsome, nor funny.",
+            "At least it isn't a horrible book.",
+            "The book was only kind of good.",
+            "The plot was good, but the characters are uncompelling",
+            "Today only kinda sux! But I'll get by, lol",
+            "Catch utf-8 emoji such as 💘 and 💋 and 😁",
+            "Sentiment analysis has never been this good!",
+            "Without a doubt, excellent idea.",
+            "one of the least compelling variations on this theme.",
+            "no good or bad news?? for $AAL",
+            "",
+        ]
+        analyzer = SentimentIntensityAnalyzer()
+        expected = [analyzer.polarity_scores(x)["compound"] for x in texts]
+        test = BatchSentimentAnalyzer(analyzer).compound(pd.Series(texts))
+        self.assertEqual(len(test), len(texts))
+        np.testing.assert_allclose(test, expected, rtol=0, atol=1e-9)
+
+    def test_missing_texts(self):
+        texts = pd.Series(["good", None, "bad", np.nan, "good"])
+        test = BatchSentimentAnalyzer().compound(texts)
+        expected = BatchSentimentAnalyzer().compound(texts.fillna(""))
+        np.testing.assert_array_equal(test, expected)
+        self.assertEqual(list(test[[1, 3]]), [0.0, 0.0])
+        with TemporaryDirectory() as tmp:
+            cached = compound_scores(texts, os.path.join(tmp, "cache.sqlite3"))
+        np.testing.assert_array_equal(cached, expected)
+
+    def test_parallel_scores_keep_order(self):
+        texts = pd.Series(["good", "bad", "not good", "great", "good", "awful"] * 5)
+        expected = compound_scores(texts)
+        test = parallel_compound(texts, workers=2, chunk_size=2)
+        np.testing.assert_array_equal(test, expected)
+
+    def test_cached_scores(self):
+        texts = pd.Series(["good stock", "bad stock", "good stock", "meh"])
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite3")
+            first = compound_scores(texts, path)
+            second = compound_scores(texts, path)
+            np.testing.assert_array_equal(first, compound_scores(texts))
+            np.testing.assert_array_equal(first, second)
+            stats = SentimentCache(path, BatchSentimentAnalyzer().version).stats()
+            self.assertEqual(stats["size"], 3)
+            self.assertEqual(stats["misses"], 3)
+            self.assertEqual(stats["hits"], 3)
+
+    def test_cache_eviction(self):
+        a, b, c = (text_hash(x) for x in ["a", "b", "c"])
+        with TemporaryDirectory() as tmp:
+            cache = SentimentCache(os.path.join(tmp, "c.sqlite3"), "v1", max_size=2)
+            cache.put_many({a: 0.1})
+            cache.put_many({b: 0.2})
+            cache.get_many([a])  # b is now least recently used
+            cache.put_many({c: 0.3})
+            self.assertEqual(cache.get_many([a, b, c]), {a: 0.1, c: 0.3})
+            self.assertEqual(cache.evictions, 1)
+            # another analyzer version does not see these scores
+            self.assertEqual(SentimentCache(cache.path, "v2").get_many([a]), {})
+
+
 class LuigiDBTest(TestCase):
     @pytest.mark.django_db
     def test_extract_to_db(self):
@@ -234,6 +554,117 @@ class LuigiDBTest(TestCase):
         self.assertTrue(test is not None)
         self.assertEqual(len(test), 78)
 
+    @pytest.mark.django_db
+    def test_extract_all_to_db(self):
+        tickers = ["aal_graph1", "aal_graph2"]
+        res = build(
+            [MockExtractAlltoDB(tickers=tickers, scheduler="threads")],
+            local_scheduler=True,
+        )
+        self.assertTrue(res)
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        for ticker in tickers:
+            test = pd.read_sql_query("SELECT * FROM {}".format(ticker), con=engine)
+            self.assertEqual(len(test), 78)
+            engine.execute("DROP TABLE {}".format(ticker))
+
+    @pytest.mark.django_db
+    def test_incremental_extract_to_db(self):
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        with TemporaryDirectory() as tmp:
+            # first load: prices up to a Friday, tweets up to the Sunday
+            finance = os.path.join(tmp, "finance.parquet")
+            old = pd.read_parquet("data/FinanceData/aal.parquet")
+            old[old["Date"] <= "2016-05-27"].to_parquet(finance)
+            first = MockIncrementalExtracttoDB(
+                "aal_incremental",
+                finance=finance,
+                twitter_end=pd.Timestamp("2016-05-29").date(),
+                incremental=True,
+            )
+            self.assertTrue(build([first], local_scheduler=True))
+            self.assertEqual(
+                get_watermark(engine, "aal_incremental").isoformat(), "2016-05-29"
+            )
+
+            # refresh with the whole data only upserts what changed
+            refresh = MockIncrementalExtracttoDB("aal_incremental", incremental=True)
+            self.assertFalse(refresh.complete())
+            self.assertEqual(refresh.restart()[0], pd.Timestamp("2016-05-27"))
+            self.assertTrue(build([refresh], local_scheduler=True))
+            self.assertTrue(refresh.complete())
+
+        test = pd.read_sql_query(
+            "SELECT * FROM aal_incremental", con=engine, parse_dates=["Date"]
+        )
+        expected = compute_graph(
+            twitter_finance(
+                "data/FinanceData/aal.parquet", "data/LocalTwitter/aal.parquet"
+            )
+        )
+        pd.testing.assert_frame_equal(
+            test, expected.astype({"signal": "int64"}), check_exact=False
+        )
+        engine.execute("DROP TABLE aal_incremental")
+
+    @pytest.mark.django_db
+    def test_incremental_analyze(self):
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        ticker, end = "aal_incremental_analyze", pd.Timestamp("2016-06-20").date()
+        extract = MockIncrementalExtracttoDB(ticker, twitter_end=end, incremental=True)
+        self.assertTrue(build([extract], local_scheduler=True))
+        rows = len(TickerTable(ticker, engine).read())
+        # past the default window
+        self.assertGreater(rows, 78)
+        analyze = MockIncrementalAnalyze(ticker, twitter_end=end, incremental=True)
+        self.assertTrue(build([analyze], local_scheduler=True))
+        self.assertTrue(analyze.complete())
+        # trained on the incremental load, not on a rebuild of the default window
+        self.assertEqual(len(TickerTable(ticker, engine).read()), rows)
+        self.assertEqual(get_watermark(engine, ticker), end)
+        engine.execute("DROP TABLE {}".format(ticker))
+        engine.execute("DROP TABLE {}_predict".format(ticker))
+        engine.execute("DELETE FROM fingerprints WHERE name LIKE ?", (ticker + "%",))
+        engine.execute("DELETE FROM nav_curves WHERE ticker = ?", (ticker,))
+
+    @pytest.mark.django_db
+    def test_fingerprint_staleness(self):
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        tickers = ["aal_fp1", "aal_fp2"]
+        finance = pd.read_parquet("data/FinanceData/aal.parquet")
+        with TemporaryDirectory() as tmp:
+            for ticker in tickers:
+                finance.to_parquet(os.path.join(tmp, "{}.parquet".format(ticker)))
+            task = MockFilesExtractAlltoDB(tickers=tickers, root=tmp)
+            self.assertTrue(build([task], local_scheduler=True))
+            self.assertTrue(task.complete())
+            # not a change of inputs, aal_fp1 must be left as it is
+            engine.execute(
+                "DELETE FROM aal_fp1 WHERE Date = (SELECT MIN(Date) FROM aal_fp1)"
+            )
+
+            # only the ticker whose parquet file changed is stale
+            finance.head(-5).to_parquet(os.path.join(tmp, "aal_fp2.parquet"))
+            outputs = task.output()
+            self.assertTrue(outputs["aal_fp1"].exists())
+            self.assertFalse(outputs["aal_fp2"].exists())
+            self.assertTrue(build([task], local_scheduler=True))
+            self.assertTrue(task.complete())
+            expected = compute_graph(
+                twitter_finance(
+                    os.path.join(tmp, "aal_fp2.parquet"),
+                    "data/LocalTwitter/aal.parquet",
+                )
+            )
+        lengths = {
+            ticker: len(pd.read_sql_query("SELECT * FROM " + ticker, con=engine))
+            for ticker in tickers
+        }
+        self.assertEqual(lengths, {"aal_fp1": 77, "aal_fp2": len(expected)})
+        for ticker in tickers:
+            engine.execute("DROP TABLE {}".format(ticker))
+        engine.execute("DELETE FROM fingerprints WHERE name LIKE 'aal_fp%'")
+
     @pytest.mark.django_db
     def test_anaylyze(self):
 
@@ -249,6 +680,50 @@ class LuigiDBTest(TestCase):
             list(test.columns),
             ["Date", "sentiment", "pct_change", "signal", "signal_predict"],
         )
+        # the graph is materialized as it would be computed per request
+        days, payload = read_curves("aal", "days, payload")
+        self.assertEqual(payload, curves_json(predict_curves("aal")))
+        first = pd.Timestamp(test["Date"].iloc[0]) - pd.Timestamp(0)
+        self.assertEqual(np.frombuffer(days, np.int32)[0], first.days)
+
+    @pytest.mark.django_db
+    def test_analyze_workers(self):
+        tickers = ["aal_workers1", "aal_workers2"]
+        # each task runs in a forked worker process, and the scheduler sees
+        # the tables the other processes wrote
+        res = build(
+            [MockAnalyze(ticker) for ticker in tickers],
+            workers=2,
+            local_scheduler=True,
+        )
+        self.assertTrue(res)
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        for ticker in tickers:
+            self.assertTrue(MockAnalyze(ticker).complete())
+            engine.execute("DROP TABLE {}".format(ticker))
+            engine.execute("DROP TABLE {}_predict".format(ticker))
+        engine.execute("DELETE FROM fingerprints WHERE name LIKE 'aal_workers%'")
+        engine.execute("DELETE FROM nav_curves WHERE ticker LIKE 'aal_workers%'")
+
+    @pytest.mark.django_db
+    def test_train_all(self):
+        tickers = ["aal_train1", "aal_train2"]
+        res = build(
+            [MockTrainAll(tickers=tickers, workers=2, n_jobs=1)], local_scheduler=True
+        )
+        self.assertTrue(res)
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        for ticker in tickers:
+            # the same models as Analyze trains one at a time
+            self.assertTrue(MockAnalyze(ticker).complete())
+            predict = TickerTable(ticker, engine, "_predict").read(parse_dates=["Date"])
+            analyze = TickerTable(ticker, engine).read(parse_dates=["Date"])
+            expected = train_predict(analyze, n_jobs=2).reset_index(drop=True)
+            pd.testing.assert_frame_equal(predict, expected)
+        self.assertEqual(balance_workers(100, cores=8), (8, 1))
+        self.assertEqual(balance_workers(2, cores=8), (2, 4))
+        self.assertEqual(balance_workers(100, n_jobs=4, cores=8), (2, 4))
+        self.assertEqual(balance_workers(100, workers=3, cores=8), (3, 2))
 
     @pytest.mark.django_db
     def test_predict(self):
@@ -260,6 +735,155 @@ class LuigiDBTest(TestCase):
             MockPredict(ticker="aal", date="2016-06-12").get_result(),
             'For 2016-06-12, the predicted result for "AAL" is SELL!',
         )
+        lookup = MockPredict(ticker="aal", date="2016-06-12").lookup()
+        self.assertEqual(lookup["Date"].tolist(), [pd.Timestamp("2016-06-12")])
+        # each (ticker, date) is its own entry
+        self.assertFalse(MockPredict(ticker="aal", date="2016-06-13").complete())
+
+
+class ModelCacheTest(TestCase):
+    def frame(self, seed):
+        rng = np.random.RandomState(seed)
+        return pd.DataFrame(
+            {
+                "Date": pd.date_range(end="2016-06-16", periods=78),
+                "sentiment": rng.randn(78),
+                "signal": rng.randint(0, 2, 78),
+            }
+        )
+
+    def test_model_cache(self):
+        with TemporaryDirectory() as tmp:
+            cache = ModelCache(tmp)
+            fitted = train_predict(self.frame(0), 1, cache, "aal")
+            self.assertFalse(cache.report["aal"][0])
+            # unchanged data and hyperparameters: loaded, whatever n_jobs
+            loaded = train_predict(self.frame(0), 2, cache, "aal")
+            hit, seconds, size = cache.report["aal"]
+            self.assertTrue(hit)
+            self.assertGreater(size, 0)
+            pd.testing.assert_frame_equal(loaded, fitted)
+            pd.testing.assert_frame_equal(fitted, train_predict(self.frame(0)))
+            # new data is fitted, and replaces the artifact of the ticker
+            train_predict(self.frame(1), 1, cache, "aal")
+            self.assertFalse(cache.report["aal"][0])
+            self.assertEqual(len(os.listdir(os.path.join(tmp, "aal"))), 1)
+            # a corrupt artifact is fitted again and replaced
+            (artifact,) = glob.glob(os.path.join(tmp, "aal", "*.joblib"))
+            with open(artifact, "wb") as f:
+                f.write(b"corrupt")
+            refitted = train_predict(self.frame(1), 1, cache, "aal")
+            self.assertFalse(cache.report["aal"][0])
+            self.assertGreater(os.path.getsize(artifact), len(b"corrupt"))
+            pd.testing.assert_frame_equal(refitted, train_predict(self.frame(1)))
+            # the reports of the pool workers come back
+            cache = ModelCache(tmp)
+            frames = {"aal": self.frame(1), "aapl": self.frame(2)}
+            train_many(frames, workers=2, n_jobs=1, cache=cache)
+            self.assertEqual(
+                {ticker: report[0] for ticker, report in cache.report.items()},
+                {"aal": True, "aapl": False},
+            )
+
+
+class ResultStoreTest(TestCase):
+    def test_keyed_results(self):
+        store = ResultStore(ttl=60, max_size=2, cache=LocMemCache("test", {}))
+        store.put("aal", "2016-06-12", "SELL")
+        store.put("aal", "2016-06-13", "BUY")
+        store.put("aapl", "2016-06-12", "BUY")
+        self.assertEqual(store.get("aal", "2016-06-12"), "SELL")
+        self.assertEqual(store.get("aapl", "2016-06-12"), "BUY")
+        # the LRU keeps two entries, the rest is read back from the cache
+        self.assertEqual(len(store._memory), 2)
+        self.assertEqual(store.get("aal", "2016-06-13"), "BUY")
+        store.invalidate("aal")
+        self.assertIsNone(store.get("aal", "2016-06-12"))
+        self.assertEqual(store.get("aapl", "2016-06-12"), "BUY")
+
+    def test_ttl(self):
+        store = ResultStore(ttl=-1, cache=LocMemCache("test_ttl", {}))
+        store.put("aal", "2016-06-12", "SELL")
+        self.assertIsNone(store.get("aal", "2016-06-12"))
+
+    def test_concurrent_threads(self):
+        store = ResultStore(cache=LocMemCache("test_threads", {}))
+        days = pd.date_range("2016-05-26", periods=20).strftime("%Y-%m-%d")
+
+        def predict(day):
+            store.put("aal", day, day)
+            return store.get("aal", day)
+
+        with ThreadPoolExecutor(8) as pool:
+            self.assertEqual(list(pool.map(predict, days)), list(days))
+
+
+class LongTableTest(TestCase):
+    def setUp(self):
+        get_config().set("storage", "long_table", "true")
+
+    def tearDown(self):
+        get_config().remove_section("storage")
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        engine.execute("DROP TABLE IF EXISTS ticker_data")
+        engine.execute("DROP TABLE IF EXISTS ticker_predict")
+
+    @pytest.mark.django_db
+    def test_long_table(self):
+        engine = create_engine("sqlite:///django.db.backends.sqlite3")
+        tickers = ["aal_long1", "aal_long2"]
+        for ticker in tickers:
+            self.assertFalse(MockAnalyze(ticker).complete())
+        res = build(
+            [
+                MockAnalyze(tickers[1]),
+                MockPredict(ticker=tickers[0], date="2016-06-12"),
+            ],
+            local_scheduler=True,
+        )
+        self.assertTrue(res)
+        self.assertEqual(
+            MockPredict(ticker="aal_long1", date="2016-06-12").get_result(),
+            'For 2016-06-12, the predicted result for "AAL_LONG1" is SELL!',
+        )
+        for ticker in tickers:
+            self.assertTrue(MockExtracttoDB(ticker).complete())
+            self.assertTrue(MockAnalyze(ticker).complete())
+        self.assertFalse(
+            SQLiteTableTarget("ticker_data", engine, ticker="fake").exists()
+        )
+
+        # one table for all tickers, keyed by (ticker, Date)
+        data = TickerTable.read_many(tickers, engine)
+        self.assertEqual(list(data.columns[:2]), ["ticker", "Date"])
+        self.assertEqual(
+            data.groupby("ticker").size().to_dict(), dict.fromkeys(tickers, 78)
+        )
+        predict = TickerTable("aal_long1", engine, "_predict").read()
+        self.assertListEqual(
+            list(predict.columns),
+            ["Date", "sentiment", "pct_change", "signal", "signal_predict"],
+        )
+        self.assertEqual(len(predict), 21)
+        with self.assertRaises(IntegrityError):
+            with engine.begin() as con:
+                TickerTable("aal_long1", engine).write(
+                    con, data.drop(columns="ticker").head(2), replace=False
+                )
+        # one scan of the long table for all tickers and days
+        signals = batch_predictions(
+            tickers + ["fake"], "2016-06-10", "2016-06-14", engine
+        )
+        self.assertEqual(list(signals.columns), tickers)
+        self.assertEqual(len(signals), 5)
+        expected = predict.set_index("Date")["signal_predict"]
+        expected.index = pd.to_datetime(expected.index)
+        pd.testing.assert_series_equal(
+            signals["aal_long1"].dropna(),
+            expected["2016-06-10":"2016-06-14"].astype(float),
+            check_names=False,
+            check_freq=False,
+        )
 
 
 class LuigiTargetTest(TestCase):
@@ -271,6 +895,199 @@ class LuigiTargetTest(TestCase):
         target = SQLiteTableTarget("test", self.engine)
         self.assertTrue(target.exists())
 
+    def test_catalog_snapshot(self):
+        with TemporaryDirectory() as tmp:
+            engine = get_engine("sqlite:///" + os.path.join(tmp, "test.sqlite3"))
+            tickers = ["t{}".format(i) for i in range(50)]
+            for ticker in tickers[:40]:
+                pd.DataFrame({"a": [1]}).to_sql(ticker, con=engine, index=False)
+            refreshes = Catalog.refreshes
+            self.assertEqual(
+                [SQLiteTableTarget(ticker, engine).exists() for ticker in tickers],
+                [True] * 40 + [False] * 10,
+            )
+            # one catalog snapshot answers every target
+            self.assertEqual(Catalog.refreshes, refreshes + 1)
+            # a write drops the snapshot
+            pd.DataFrame({"a": [1]}).to_sql("t45", con=engine, index=False)
+            self.assertTrue(SQLiteTableTarget("t45", engine).exists())
+            with engine.begin() as con:
+                TickerTable("t46", engine, long=True).write(
+                    con, pd.DataFrame({"Date": [pd.Timestamp("2016-04-01")]})
+                )
+            self.assertTrue(SQLiteTableTarget("ticker_data", engine, "t46").exists())
+            self.assertFalse(SQLiteTableTarget("ticker_data", engine, "t47").exists())
+            self.assertEqual(Catalog.refreshes, refreshes + 3)
+            engine.dispose()
+
+    def test_etag_fingerprint(self):
+        fs = Mock()
+        path = "s3://bucket/FinanceData/etag.parquet"
+        with patch("fsspec.core.url_to_fs", return_value=(fs, path[5:])):
+            get_config().set("file_fingerprints", "etag_ttl", "-1")
+            try:
+                for etag in ["etag1", "etag2"]:
+                    fs.info.return_value = {"ETag": '"{}"'.format(etag)}
+                    self.assertEqual(file_fingerprint(path), etag)
+            finally:
+                get_config().remove_section("file_fingerprints")
+            fs.info.return_value = {"ETag": '"etag3"'}
+            self.assertEqual([file_fingerprint(path) for _ in range(3)], ["etag3"] * 3)
+        # the ETag is asked once per etag_ttl
+        self.assertEqual(fs.info.call_count, 3)
+
+    def test_ticker_table_date_index(self):
+        engine = create_engine("sqlite://")
+        test = pd.DataFrame({"Date": pd.date_range("2016-04-01", periods=3)})
+        with engine.begin() as con:
+            TickerTable("test", engine, "_predict", long=False).write(con, test)
+        index = engine.execute(
+            "SELECT name FROM sqlite_master WHERE type='index'"
+        ).fetchall()
+        self.assertEqual(index, [("test_predict_date",)])
+
+
+class EngineRegistryTest(TestCase):
+    def test_shared_pooled_engine(self):
+        with TemporaryDirectory() as tmp:
+            url = "sqlite:///" + os.path.join(tmp, "test.sqlite3")
+            engine = get_engine(url)
+            self.assertIs(get_engine(url), engine)
+            with engine.connect() as con:
+                self.assertEqual(con.execute("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(con.execute("PRAGMA synchronous").scalar(), 1)
+                self.assertEqual(con.execute("PRAGMA cache_size").scalar(), -65536)
+            engine.execute("SELECT 1")
+            metrics = pool_metrics(url)
+            # both calls reuse the one pooled connection
+            self.assertEqual(metrics["connects"], 1)
+            self.assertEqual(metrics["checkouts"], 2)
+            self.assertEqual(metrics["checked_out"], 0)
+            engine.dispose()
+
+
+class JobQueueTest(TestCase):
+    def test_background_build(self):
+        cache = LocMemCache("test_jobs", {})
+        jobs = JobQueue(workers=1, cache=cache)
+        with TemporaryDirectory() as tmp:
+            task = MockJob(os.path.join(tmp, "job.txt"))
+            job = jobs.submit([task])
+            self.assertIn(jobs.status(job)["status"], ["queued", "running"])
+            status = jobs.wait(job, timeout=300)
+            self.assertTrue(task.complete())
+            self.assertIn(task.path, MockJob.succeeded)
+        jobs.shutdown()
+        self.assertEqual((status["status"], status["result"]), ("done", "SUCCESS"))
+        self.assertEqual(list(status["tasks"]), [task.task_id])
+        progress = status["tasks"][task.task_id]
+        self.assertEqual(progress["status"], "succeeded")
+        self.assertGreaterEqual(progress["duration"], 0)
+        self.assertLessEqual(progress["started"], progress["finished"])
+        events = [event["event"] for event in jobs.follow(job)]
+        self.assertEqual(events, ["scheduled", "started", "duration", "succeeded"])
+        # another server process reads the status from the cache
+        other = JobQueue(workers=1, cache=cache)
+        self.assertFalse(other.owns(job))
+        self.assertEqual(other.status(job)["status"], "done")
+        other.shutdown()
+
+    def test_scheduled_events(self):
+        jobs = JobQueue(workers=1, cache=LocMemCache("test_jobs_scheduled", {}))
+        with TemporaryDirectory() as tmp:
+            task = MockChainJob(os.path.join(tmp, "chain.txt"))
+            done, pending = task.requires()
+            with open(done.path, "w") as f:
+                f.write("done")
+            job = jobs.run([task], timeout=300)["id"]
+        jobs.shutdown()
+        events = {}
+        for event in jobs.follow(job):
+            events.setdefault(event["task"], []).append(event["event"])
+        # every task to run is scheduled once, then started and done
+        for run in (task, pending):
+            self.assertEqual(
+                events[run.task_id], ["scheduled", "started", "duration", "succeeded"]
+            )
+        self.assertEqual(events[done.task_id], ["complete"])
+
+    def test_job_retention(self):
+        cache = LocMemCache("test_jobs_retention", {})
+        jobs = JobQueue(workers=1, cache=cache, retention=0)
+        with TemporaryDirectory() as tmp:
+            first = jobs.run([MockJob(os.path.join(tmp, "first.txt"))], timeout=300)
+            self.assertTrue(jobs.owns(first["id"]))
+            second = jobs.submit([MockJob(os.path.join(tmp, "second.txt"))])
+            # the finished job is dropped at the next submit
+            self.assertFalse(jobs.owns(first["id"]))
+            self.assertNotIn(first["id"], jobs._futures)
+            self.assertEqual(jobs.status(first["id"])["status"], "done")
+            self.assertEqual(jobs.wait(first["id"])["status"], "done")
+            self.assertEqual(jobs.wait(second, timeout=300)["status"], "done")
+        jobs.shutdown()
+
+    def test_catalog_after_job(self):
+        # snapshots outlive the job, only the end of the job drops them
+        get_config().set("storage", "catalog_ttl", "3600")
+        jobs = JobQueue(workers=1, cache=LocMemCache("test_jobs_catalog", {}))
+        try:
+            with TemporaryDirectory() as tmp:
+                task = MockTableJob(
+                    "sqlite:///" + os.path.join(tmp, "test.sqlite3"), "t"
+                )
+                self.assertFalse(task.complete())
+                jobs.run([task], timeout=300)
+                self.assertTrue(task.complete())
+                get_engine(task.url).dispose()
+        finally:
+            jobs.shutdown()
+            get_config().remove_section("storage")
+
+
+class GraphTest(TestCase):
+    def test_batch_curves(self):
+        with TemporaryDirectory() as tmp:
+            engine = create_engine("sqlite:///" + os.path.join(tmp, "test.sqlite3"))
+            frames = {}
+            for ticker, start, days in [
+                ("a", "2016-01-01", 30),
+                ("b", "2016-01-10", 5),
+            ]:
+                rng = np.random.RandomState(len(ticker) + days)
+                frames[ticker] = pd.DataFrame(
+                    {
+                        "Date": pd.date_range(start, periods=days),
+                        "pct_change": rng.randn(days),
+                        "signal_predict": rng.randint(0, 2, days),
+                    }
+                )
+                with engine.begin() as con:
+                    TickerTable(ticker, engine, "_predict").write(con, frames[ticker])
+            nav, nav_strategy = batch_curves(["b", "a"], engine)
+        # aligned on the union of the dates, each column its ticker's curves
+        self.assertEqual(list(nav.columns), ["b", "a"])
+        self.assertEqual(len(nav), 30)
+        for ticker, frame in frames.items():
+            curves = nav_curves(frame).set_index("Date")
+            column = nav[ticker].dropna()
+            self.assertListEqual(list(column.index), list(curves.index))
+            np.testing.assert_allclose(column, curves["nav"])
+            np.testing.assert_allclose(
+                nav_strategy[ticker].dropna(), curves["nav_strategy"]
+            )
+
+    def test_lttb(self):
+        x = np.arange(1000.0)
+        y = np.column_stack([np.sin(x / 50), np.zeros(1000)])
+        y[500, 1] = 5
+        index = lttb(x, y, 100)
+        self.assertEqual(len(index), 100)
+        self.assertTrue((np.diff(index) > 0).all())
+        # the ends and the spike are kept
+        self.assertEqual([index[0], index[-1]], [0, 999])
+        self.assertIn(500, index)
+        self.assertListEqual(list(lttb(x[:10], y[:10], 100)), list(range(10)))
+
 
 class DjangoTest(DJTest):
     def test_basic_views(self):
@@ -280,6 +1097,219 @@ class DjangoTest(DJTest):
 
     def test_loadingData_view(self):
         req = RequestFactory().get("/twitter_stock/loadingData/")
-        resp = loadingData(req)
-        self.assertTrue(resp.status_code == 200)
-        self.assertEqual(resp.content, b"")
+        with TemporaryDirectory() as tmp:
+            task = MockJob(os.path.join(tmp, "job.txt"))
+            with patch("twitter_stock.utils.my_request.LoadAllData") as load:
+                load.return_value = task
+                resp = loadingData(req)
+            # the load runs in the background
+            self.assertEqual(resp.status_code, 202)
+            job = json.loads(resp.content)
+            status = self.client.get(job["url"])
+            self.assertEqual(status.status_code, 200)
+            self.assertEqual(json.loads(status.content)["id"], job["job"])
+            get_jobs().wait(job["job"])
+            self.assertTrue(task.complete())
+        self.assertEqual(self.client.get("/twitter_stock/jobs/fake/").status_code, 404)
+
+    def test_share_view(self):
+        with TemporaryDirectory() as tmp:
+            task = MockJob(os.path.join(tmp, "job.txt"))
+            with patch("twitter_stock.utils.my_request.Share") as share:
+                share.return_value = task
+                resp = self.client.post(
+                    "/twitter_stock/share/", {"ticker": "AAL", "myDate": "2016-06-12"}
+                )
+            share.assert_called_once_with("aal", "2016-06-12")
+            # posted in the background
+            self.assertEqual(resp.status_code, 202)
+            status = get_jobs().wait(json.loads(resp.content)["job"])
+        self.assertEqual(status["status"], "done")
+
+    def test_asgi(self):
+        def call(method, path, body=b""):
+            scope = {
+                "type": "http",
+                "method": method,
+                "path": path,
+                "query_string": b"",
+                "http_version": "1.1",
+                "headers": [
+                    (b"host", b"testserver"),
+                    (b"content-type", b"application/x-www-form-urlencoded"),
+                ],
+            }
+            messages = []
+            received = []
+
+            async def receive():
+                if received:
+                    # no disconnect, the client waits for the whole response
+                    await asyncio.Event().wait()
+                received.append(body)
+                return {"type": "http.request", "body": body}
+
+            async def send(message):
+                messages.append(message)
+
+            asyncio.run(asgi_application(scope, receive, send))
+            body = b"".join(message.get("body", b"") for message in messages[1:])
+            return messages[0]["status"], body, dict(messages[0]["headers"])
+
+        finished = []
+
+        def on_finished(sender, **kwargs):
+            finished.append(sender)
+
+        request_finished.connect(on_finished)
+        try:
+            status, body, headers = call(
+                "POST", "/twitter_stock/mygraph/", b"ticker=AAL"
+            )
+        finally:
+            request_finished.disconnect(on_finished)
+        self.assertEqual(status, 200)
+        self.assertEqual(list(json.loads(body)), ["date", "nav", "nav_strategy"])
+        # served by Django's handler, signals and middleware included
+        self.assertEqual(len(finished), 1)
+        self.assertIn(b"x-frame-options", headers)
+        # a view raising is a 500, not an error of the server
+        self.assertEqual(call("POST", "/twitter_stock/predict/")[0], 500)
+        status, body, headers = call(
+            "POST", "/twitter_stock/predict/", b"ticker=aal&myDate=2016-06-12"
+        )
+        self.assertEqual(
+            body.decode(), 'For 2016-06-12, the predicted result for "AAL" is SELL!'
+        )
+        # the other views, and unknown paths, run in the general pool
+        self.assertEqual(call("GET", "/")[0], 200)
+        self.assertEqual(call("GET", "/fake")[0], 404)
+
+    def test_asgi_disconnect(self):
+        closed = []
+
+        def stream():
+            try:
+                while True:
+                    yield b"data: {}\n\n"
+            finally:
+                closed.append(True)
+
+        def wsgi_application(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/event-stream")])
+            return stream()
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/twitter_stock/jobs/1/events/",
+            "query_string": b"",
+            "http_version": "1.1",
+            "headers": [(b"host", b"testserver")],
+        }
+        messages = []
+        received = []
+
+        async def main():
+            sent = asyncio.Event()
+
+            async def receive():
+                if not received:
+                    received.append(True)
+                    return {"type": "http.request", "body": b""}
+                await sent.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                messages.append(message)
+                if len(messages) > 3:
+                    sent.set()
+
+            await asgi_application(scope, receive, send)
+
+        with patch("config.asgi.wsgi_application", wsgi_application):
+            asyncio.run(asyncio.wait_for(main(), 10))
+        # the endless stream is closed once the client is gone
+        self.assertEqual(closed, [True])
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertTrue(all(message.get("more_body") for message in messages[1:]))
+
+    def test_mygraph_view(self):
+        full = json.loads(self.client.get("/twitter_stock/mygraph/?ticker=aal").content)
+        resp = self.client.get(
+            "/twitter_stock/mygraph/",
+            {"ticker": "aal", "points": 5},
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+        self.assertIn("Server-Timing", resp)
+        self.assertEqual(resp["Content-Encoding"], "gzip")
+        small = json.loads(gzip.decompress(resp.content))
+        self.assertEqual(len(small["date"]), 5)
+        self.assertEqual(small["date"][0], full["date"][0])
+        self.assertEqual(small["date"][-1], full["date"][-1])
+        # unchanged curves are revalidated, not sent again
+        again = self.client.get(
+            "/twitter_stock/mygraph/",
+            {"ticker": "aal", "points": 5},
+            HTTP_IF_NONE_MATCH=resp["ETag"],
+        )
+        self.assertEqual(again.status_code, 304)
+        binary = self.client.get(
+            "/twitter_stock/mygraph/", {"ticker": "aal", "format": "binary"}
+        ).content
+        n = np.frombuffer(binary[:4], "<u4")[0]
+        self.assertEqual(n, len(full["date"]))
+        days = np.frombuffer(binary[4 : 4 + 4 * n], "<i4")
+        self.assertEqual(str(np.datetime64(int(days[-1]), "D")), full["date"][-1])
+        nav = np.frombuffer(binary[4 + 4 * n : 4 + 8 * n], "<f4")
+        np.testing.assert_allclose(nav, full["nav"], rtol=1e-6, atol=1e-7)
+        bad = self.client.get("/twitter_stock/mygraph/?ticker=aal&points=1")
+        self.assertEqual(bad.status_code, 400)
+
+    def test_predictions_view(self):
+        resp = self.client.get(
+            "/twitter_stock/predictions/",
+            {"tickers": "aal,fake", "start": "2016-06-10", "end": "2016-06-20"},
+        )
+        batch = json.loads(resp.content)
+        self.assertEqual(batch["tickers"], ["aal"])
+        self.assertEqual(batch["missing"], ["fake"])
+        self.assertEqual(len(batch["date"]), 11)
+        # the same signals as one /predict/ per date, and no job started
+        for day, signal in zip(batch["date"], batch["signals"][0]):
+            result = get_prediction("aal", day) if signal != "-" else None
+            if day < "2016-06-16":
+                self.assertIn({"B": "BUY", "S": "SELL"}[signal], result)
+            else:
+                self.assertEqual(signal, "-")
+        bad = {"tickers": "aal", "start": "2016-06-20", "end": "2016-06-10"}
+        self.assertEqual(
+            self.client.get("/twitter_stock/predictions/", bad).status_code, 400
+        )
+
+    def test_mygraphs_view(self):
+        single = json.loads(
+            self.client.get("/twitter_stock/mygraph/?ticker=aal").content
+        )
+        resp = self.client.get("/twitter_stock/mygraphs/", {"tickers": "AAL,fake,aal"})
+        batch = json.loads(resp.content)
+        self.assertEqual(batch["tickers"], ["aal"])
+        self.assertEqual(batch["missing"], ["fake"])
+        self.assertEqual(batch["date"], single["date"])
+        # to 15 significant digits, the curves are summed in another order
+        for curve in ("nav", "nav_strategy"):
+            np.testing.assert_allclose(
+                batch[curve][0], single[curve], rtol=1e-13, atol=1e-15
+            )
+        self.assertEqual(self.client.get("/twitter_stock/mygraphs/").status_code, 400)
+
+    def test_job_events_view(self):
+        with TemporaryDirectory() as tmp:
+            job = get_jobs().submit([MockJob(os.path.join(tmp, "job.txt"))])
+            resp = self.client.get("/twitter_stock/jobs/{}/events/".format(job))
+            self.assertEqual(resp["Content-Type"], "text/event-stream")
+            stream = b"".join(resp.streaming_content).decode()
+        names = [line[7:] for line in stream.splitlines() if line.startswith("event: ")]
+        self.assertEqual(names, ["scheduled", "started", "duration", "succeeded"])
+        data = [line for line in stream.splitlines() if line.startswith("data: ")]
+        self.assertEqual(json.loads(data[-1][6:])["family"], "MockJob")
@@ -8,6 +8,10 @@ urlpatterns = [
     url(r"^$", my.my_page),
     path("loadingData/", my.loadingData),
     path("predict/", my.predict),
+    path("predictions/", my.predictions),
     path("mygraph/", my.mygraph),
+    path("mygraphs/", my.mygraphs),
     path("share/", my.share),
+    path("jobs/<str:job>/", my.jobs),
+    path("jobs/<str:job>/events/", my.job_events),
 ]
@@ -1,56 +1,118 @@
-from luigi.mock import MockTarget
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestClassifier
+import json
+import logging
+import time
 from .loaddata_tasks import *
+from .db_target import LONG_TABLES, storage
+from .results import ResultStore, ResultTarget
+from .graph import nav_curves, store_curves
+from .train import ModelCache, train_many, train_predict
 
+logger = logging.getLogger(__name__)
 
-class Analyze(Task):
+
+class Analyze(Fingerprinted, Task):
     """
     Analyze twitter's content by sentiment, and use random forest classifier to train model.
+    Retrained only when the fingerprint of the cleaned data changes.
+    example usage: Analyze('aapl', incremental=True, twitter_end=today)
+                   #train on the data ExtracttoDB upserted up to today
     """
 
-    engine = create_engine(os.environ["DATABASE_URL"])
+    # the cleaned data's fingerprint already covers how it was extracted
+    fingerprint_exclude = ("twitter_start", "twitter_end", "incremental")
+
+    engine = get_engine()
+    extract = ExtracttoDB
     ticker = Parameter()
+    # passed to ExtracttoDB, so an incremental load is not rebuilt in full
+    twitter_start = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[0]).date())
+    twitter_end = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[1]).date())
+    incremental = BoolParameter(default=False)
+    # trees fitted at a time, the model does not depend on it
+    n_jobs = IntParameter(default=1, significant=False)
+    # fitted models by ticker and training data, None to always fit
+    model_cache = os.path.join(local_root, "models")
 
     def requires(self):
-        return ExtracttoDB(self.ticker)
+        return self.extract(
+            self.ticker,
+            twitter_start=self.twitter_start,
+            twitter_end=self.twitter_end,
+            incremental=self.incremental,
+        )
 
     def output(self):
-        return SQLiteTableTarget(
-            table="{}_predict".format(self.ticker), eng=self.engine
+        return TickerTable(self.ticker, self.engine, "_predict").target(
+            self.fingerprint
         )
 
     def run(self):
         # get data from db
-        analyze = pd.read_sql_query(
-            """SELECT * FROM {}""".format(self.ticker),
-            con=self.engine,
-            parse_dates=["Date"],
-        )
-        # align dates (predict occurs on the next day)
-        analyze["signal"] = analyze["signal"].shift(-1, fill_value=0)
-        # splitting data for train and predict
-        train = analyze[analyze["Date"] <= "2016-05-31"]
-        predict = analyze[
-            (analyze["Date"] > "2016-05-25") & (analyze["Date"] < "2016-06-16")
-        ]
-        x_train, x_test, y_train, y_test = train_test_split(
-            np.array(train[["sentiment"]]),
-            np.array(train[["signal"]]),
-            test_size=0.2,
-            random_state=40,
-        )
-        # train model
-        model = RandomForestClassifier(random_state=40)
-        model.fit(x_train, y_train)
+        analyze = TickerTable(self.ticker, self.engine).read(parse_dates=["Date"])
+        predict = train_predict(analyze, self.n_jobs, self.models(), self.ticker)
         # get predict result and send back to db
-        predict["signal_predict"] = model.predict(np.array(predict[["sentiment"]]))
-        predict.to_sql(
-            "{}_predict".format(self.ticker),
-            con=self.engine,
-            if_exists="replace",
-            index=False,
+        with self.engine.begin() as con:
+            self.store(con, predict)
+        # predictions of the old model are stale
+        Predict.results.invalidate(self.ticker)
+
+    def after_job(self):
+        # run in a JobQueue worker, the results of this process are stale too
+        Predict.results.invalidate(self.ticker)
+
+    @classmethod
+    def models(cls):
+        return None if cls.model_cache is None else ModelCache(cls.model_cache)
+
+    def store(self, con, predict):
+        TickerTable(self.ticker, self.engine, "_predict").write(con, predict)
+        # the graph of the ticker is served as stored here
+        store_curves(con, self.ticker, nav_curves(predict))
+        self.output().record(con)
+
+
+class TrainAll(Task):
+    """
+    Analyze many tickers at once: their models are trained over a process
+    pool, workers processes fitting n_jobs trees each (0 balances them
+    against the cores, see train.balance_workers), and stored in one
+    transaction.
+    """
+
+    analyze = Analyze
+    tickers = ListParameter()
+    workers = IntParameter(default=0, significant=False)
+    n_jobs = IntParameter(default=0, significant=False)
+
+    def requires(self):
+        return {ticker: self.analyze(ticker).requires() for ticker in self.tickers}
+
+    def output(self):
+        # tickers whose cleaned data did not change are left as they are
+        return {ticker: self.analyze(ticker).output() for ticker in self.tickers}
+
+    def run(self):
+        outputs = self.output()
+        todo = [ticker for ticker, table in outputs.items() if not table.exists()]
+        # the engine of the targets, so the catalog sees the writes
+        engine = self.analyze.engine
+        frames = {
+            ticker: TickerTable(ticker, engine).read(parse_dates=["Date"])
+            for ticker in todo
+        }
+        predictions = train_many(
+            frames, self.workers, self.n_jobs, self.analyze.models()
         )
+        with engine.begin() as con:
+            for ticker, predict in predictions.items():
+                self.analyze(ticker).store(con, predict)
+        for ticker in predictions:
+            Predict.results.invalidate(ticker)
+
+    def after_job(self):
+        # tickers left as they were only lose their cached results
+        for ticker in self.tickers:
+            Predict.results.invalidate(ticker)
 
 
 class Predict(Task):
@@ -58,7 +120,9 @@ class Predict(Task):
     Predict the result using trained model.
     """
 
-    engine = create_engine(os.environ["DATABASE_URL"])
+    engine = get_engine()
+    # shared by every Predict, one entry per (ticker, date)
+    results = ResultStore()
     ticker = Parameter()
     date = Parameter()
 
@@ -66,27 +130,110 @@ class Predict(Task):
         return Analyze(self.ticker)
 
     def output(self):
-        # use mock target to save the output, desired output type str
-        return MockTarget("predict_result")
+        return ResultTarget(self.results, self.ticker, self.date)
+
+    def table(self):
+        return TickerTable(self.ticker, self.engine, "_predict")
+
+    def lookup(self):
+        """
+        Predictions of the day: a parameterized range scan of the Date index
+        """
+        day = pd.Timestamp(self.date).normalize()
+        start = time.perf_counter()
+        query = self.table().select(
+            "Date, signal_predict",
+            "Date >= ? AND Date < ?",
+            (sql_date(day), sql_date(day + pd.Timedelta(days=1))),
+        )
+        # a point lookup, so skip read_sql_query's overhead
+        predict = pd.DataFrame(
+            self.engine.execute(*query).fetchall(), columns=["Date", "signal_predict"]
+        )
+        predict["Date"] = pd.to_datetime(predict["Date"])
+        logger.info(
+            "predict lookup of %s on %s took %.2fms",
+            self.ticker,
+            day.date(),
+            (time.perf_counter() - start) * 1000,
+        )
+        return predict
 
     def run(self):
         # get query from db
-        predict = pd.read_sql_query(
-            '''SELECT date, signal_predict FROM {}_predict WHERE date LIKE "{}%"'''.format(
-                self.ticker, self.date
-            ),
-            con=self.engine,
-            parse_dates=["Date"],
-        )
+        predict = self.lookup()
         result = "BUY" if predict["signal_predict"][0] == 1 else "SELL"
         text = 'For {}, the predicted result for "{}" is {}!'.format(
             self.date, self.ticker.upper(), result
         )
-        with self.output().open("w") as f:
-            f.write(text)
+        self.output().write(text)
 
     def get_result(self):
-        # get result back as str from mocktarget
-        with self.output().open("r") as f:
-            result = f.read()
-        return result
+        # get result back as str from the result store
+        return self.output().read()
+
+
+def get_prediction(ticker, date):
+    """
+    Prediction text of ticker on date, from the result store or else from
+    the stored predictions. None while the model of ticker is not trained
+    """
+    task = Predict(ticker, date)
+    result = task.results.get(ticker, date)
+    if result is None and task.table().target().exists():
+        # a point lookup, no need to schedule the dependencies
+        task.run()
+        result = task.get_result()
+    return result
+
+
+def batch_predictions(tickers, start, end, eng=None):
+    """
+    Signals of tickers on every day from start to end, as a (date x ticker)
+    frame of 1 (BUY), 0 (SELL) and NaN where there is no prediction. One
+    range scan of the long table, or one per ticker table, without Luigi:
+    tickers whose model is not trained yet are left out of the columns.
+    """
+    eng = eng or Predict.engine
+    days = pd.date_range(start, end)
+    if days.empty:
+        raise ValueError("end before start")
+    bounds = (sql_date(days[0]), sql_date(days[-1] + pd.Timedelta(days=1)))
+    found = TickerTable.stored(tickers, eng, "_predict")
+    rows = []
+    with eng.connect() as con:
+        if found and storage().long_table:
+            query = (
+                "SELECT ticker, Date, signal_predict FROM {} "
+                "WHERE ticker IN ({}) AND Date >= ? AND Date < ?"
+            ).format(LONG_TABLES["_predict"], ", ".join("?" * len(found)))
+            rows = con.execute(query, tuple(found) + bounds).fetchall()
+        elif found:
+            for ticker in found:
+                query = TickerTable(ticker, eng, "_predict", long=False).select(
+                    "Date, signal_predict", "Date >= ? AND Date < ?", bounds
+                )
+                rows.extend((ticker,) + tuple(row) for row in con.execute(*query))
+    signals = pd.DataFrame(rows, columns=["ticker", "Date", "signal_predict"])
+    signals["Date"] = pd.to_datetime(signals["Date"]).dt.normalize()
+    signals = signals.pivot(index="Date", columns="ticker", values="signal_predict")
+    return signals.reindex(index=days, columns=found).astype(float)
+
+
+def predictions_json(tickers, start, end):
+    """
+    /predictions/ payload: the dates, the tickers whose model is trained,
+    one string per ticker of B (BUY), S (SELL) or - (no prediction) per
+    date, and the tickers not trained yet
+    """
+    signals = batch_predictions(tickers, start, end)
+    letters = np.array(["S", "B", "-"])
+    codes = signals.fillna(2).to_numpy(dtype=int).T
+    return json.dumps(
+        {
+            "date": signals.index.strftime("%Y-%m-%d").to_list(),
+            "tickers": list(signals.columns),
+            "signals": ["".join(row) for row in letters[codes]],
+            "missing": [ticker for ticker in tickers if ticker not in signals],
+        }
+    )
@@ -0,0 +1,17 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from . import my_request
+
+# bounded pool for the blocking SQLite and pandas reads, apart from the
+# threads of every other request
+executor = ThreadPoolExecutor(
+    int(os.environ.get("ASYNC_READ_THREADS", 8)), thread_name_prefix="read"
+)
+
+# read-only views, as routed by twitter_stock.urls, that config.asgi serves
+# in the read pool; predict is not one, it may submit a build
+read_views = {
+    my_request.predictions,
+    my_request.mygraph,
+    my_request.mygraphs,
+}
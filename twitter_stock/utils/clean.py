@@ -1,16 +1,23 @@
 import dask
+import fsspec
 import math
 import pandas as pd
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+import pyarrow.dataset as ds
+from .sentiment import compound_scores
+
+# dates we need to align with all stock tickers
+TWITTER_WINDOW = ("2016-03-31", "2016-06-15")
 
 
 @dask.delayed
-def clean_finance(file):
+def clean_finance(file, since=None):
     """
     Helper function to clean data using dask
+    since: optional first date to read, e.g. the last trading day stored
     """
     # read only columns needed
-    finance = pd.read_parquet(file, columns=["Date", "Adj Close"])
+    filters = None if since is None else [("Date", ">=", pd.Timestamp(since))]
+    finance = pd.read_parquet(file, columns=["Date", "Adj Close"], filters=filters)
     # fill the missing dates (market closed dates)
     alldate = pd.date_range(start=finance["Date"].min(), end=finance["Date"].max())
     finance = (
@@ -23,21 +30,39 @@ def clean_finance(file):
     return finance
 
 
+def read_twitter(file, window=TWITTER_WINDOW):
+    """
+    Read the tweets inside the date window that have a follower count.
+    Both filters are pushed down into the parquet scan, so row groups whose
+    Date statistics fall outside the window are never read.
+    """
+    fs, path = fsspec.core.url_to_fs(file)
+    dataset = ds.dataset(path, filesystem=fs, format="parquet")
+    start, end = (pd.Timestamp(x).to_pydatetime() for x in window)
+    date = ds.field("Date")
+    table = dataset.to_table(
+        columns=["Date", "Tweet content", "Followers"],
+        filter=(date >= start) & (date <= end) & ds.field("Followers").is_valid(),
+    )
+    twitter = table.to_pandas()
+    # NaN (as opposed to null) followers are not caught by is_valid
+    return twitter[twitter["Followers"].notnull()]
+
+
 @dask.delayed
-def clean_twitter(file):
+def clean_twitter(
+    file, cache_path=None, workers=1, chunk_size=20000, window=TWITTER_WINDOW
+):
     """
     Helper function to clean data using dask
+    cache_path: optional sqlite file caching sentiment scores across runs
+    workers, chunk_size: score tweets in chunks over a process pool
+    window: (start, end) dates of tweets to keep, both inclusive
     """
-    twitter = pd.read_parquet(file, columns=["Date", "Tweet content", "Followers"])
-    # extract data for dates we need to align with all stock tickers
-    twitter = twitter[
-        (twitter["Date"] >= "2016-03-31") & (twitter["Date"] <= "2016-06-15")
-    ]
-    twitter = twitter[twitter["Followers"].notnull()]
-    # get sentiment analysis of twitter content
-    analyzer = SentimentIntensityAnalyzer()
-    twitter["compound"] = twitter["Tweet content"].apply(
-        lambda x: analyzer.polarity_scores(x)["compound"]
+    twitter = read_twitter(file, window)
+    # get sentiment analysis of twitter content (whole column in one batch)
+    twitter["compound"] = compound_scores(
+        twitter["Tweet content"], cache_path, workers, chunk_size
     )
     # take out "no sentiment" tweets
     twitter = twitter[twitter["compound"] != 0]
@@ -48,20 +73,83 @@ def clean_twitter(file):
     return out
 
 
-@dask.delayed
-def twitter_finance(file1, file2):
+def fill_signal(out):
     """
-    Helper function to combine data using dask
+    Helper function to fill combined data and add the buy/sell signal
     """
-    finance = list(dask.compute(clean_finance(file1)))[0]
-    twitter = list(dask.compute(clean_twitter(file2)))[0]
-    # combine data
-    out = twitter.merge(
-        finance, how="outer", right_on="Date", left_on="Date", sort=True
-    )
     # fill in missing values where no data exists
     out["sentiment"][:-1].fillna(method="ffill", inplace=True)
     out["sentiment"][:-1].fillna(method="bfill", inplace=True)
     # get real buy/sell signal in order to train model
     out["signal"] = [True if x > 0 else False for x in out["pct_change"]]
     return out
+
+
+@dask.delayed
+def combine(finance, twitter):
+    """
+    Helper function to combine cleaned data using dask
+    """
+    out = twitter.merge(
+        finance, how="outer", right_on="Date", left_on="Date", sort=True
+    )
+    return fill_signal(out)
+
+
+@dask.delayed
+def extend(stored, seed, finance, twitter, anchor, watermark):
+    """
+    Helper function to combine newly cleaned data with the stored rows it
+    changes, giving the rows combine would give over the whole history.
+    stored: stored rows from min(anchor, watermark) on
+    seed: last stored sentiment before them, carried forward
+    anchor: last stored trading day, later finance rows are new
+    watermark: last stored tweet date, later twitter rows are new
+    """
+    sentiment = pd.concat(
+        [
+            stored.loc[stored["Date"] <= watermark, ["Date", "sentiment"]],
+            twitter[twitter["Date"] > watermark],
+        ]
+    )
+    prices = pd.concat(
+        [
+            stored.loc[stored["Date"] <= anchor, ["Date", "pct_change"]],
+            finance[finance["Date"] > anchor],
+        ]
+    )
+    out = sentiment.merge(prices, how="outer", on="Date", sort=True)
+    # put the seed in front, so the boundary is filled as in a full rebuild
+    out = pd.concat(
+        [pd.DataFrame({"Date": [pd.NaT], "sentiment": [seed]}), out],
+        ignore_index=True,
+    )
+    return fill_signal(out).iloc[1:].reset_index(drop=True)
+
+
+def twitter_finance(
+    file1, file2, cache_path=None, workers=1, chunk_size=20000, window=TWITTER_WINDOW
+):
+    """
+    Build the dask graph cleaning and combining one ticker's data.
+    Finance and twitter cleaning are independent nodes, so they can overlap,
+    and graphs of many tickers can be computed together.
+    """
+    return combine(
+        clean_finance(file1),
+        clean_twitter(file2, cache_path, workers, chunk_size, window),
+    )
+
+
+def compute_graph(graph, scheduler="threads", num_workers=None):
+    """
+    Compute a dask graph (e.g. a dict of ticker -> twitter_finance) in one
+    pass with the "threads", "processes" or "distributed" scheduler; the
+    latter starts a local dask.distributed cluster for the call.
+    """
+    if scheduler == "distributed":
+        from dask.distributed import Client, LocalCluster
+
+        with LocalCluster(n_workers=num_workers) as cluster, Client(cluster):
+            return dask.compute(graph)[0]
+    return dask.compute(graph, scheduler=scheduler, num_workers=num_workers)[0]
@@ -0,0 +1,104 @@
+import os
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.pool import QueuePool
+
+_engines = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _setting(name, default):
+    return int(os.environ.get(name, default))
+
+
+def sqlite_pragmas():
+    """
+    Pragmas set on every new SQLite connection, sizes from the environment:
+    SQLITE_MMAP_SIZE in bytes, SQLITE_CACHE_SIZE in pages (negative: KiB)
+    """
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": _setting("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+        "cache_size": _setting("SQLITE_CACHE_SIZE", -64 * 1024),
+    }
+
+
+def _create(url):
+    """
+    Engine with a sized connection pool, SQLite pragmas and pool metrics
+    """
+    kwargs = {}
+    sqlite = make_url(url).get_backend_name() == "sqlite"
+    in_memory = sqlite and make_url(url).database in (None, "", ":memory:")
+    if not in_memory:
+        # in-memory SQLite keeps its single connection pool
+        kwargs.update(
+            poolclass=QueuePool,
+            pool_size=_setting("DB_POOL_SIZE", 5),
+            max_overflow=_setting("DB_MAX_OVERFLOW", 10),
+            pool_timeout=_setting("DB_POOL_TIMEOUT", 30),
+            pool_pre_ping=not sqlite,
+        )
+    if sqlite and not in_memory:
+        # pooled connections are handed to the thread that checks them out
+        kwargs["connect_args"] = {"check_same_thread": False}
+    engine = create_engine(url, **kwargs)
+    metrics = {"connects": 0, "checkouts": 0, "checkins": 0, "checked_out": 0}
+    metrics["max_checked_out"] = 0
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_con, record):
+        record.info["pid"] = os.getpid()
+        metrics["connects"] += 1
+        if sqlite:
+            cursor = dbapi_con.cursor()
+            for name, value in sqlite_pragmas().items():
+                cursor.execute("PRAGMA {} = {}".format(name, value))
+            cursor.close()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_con, record, proxy):
+        # a forked luigi worker must not reuse its parent's connections
+        if record.info["pid"] != os.getpid():
+            record.dbapi_connection = proxy.dbapi_connection = None
+            raise DisconnectionError("connection belongs to another process")
+        metrics["checkouts"] += 1
+        metrics["checked_out"] += 1
+        metrics["max_checked_out"] = max(
+            metrics["max_checked_out"], metrics["checked_out"]
+        )
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_con, record):
+        metrics["checkins"] += 1
+        metrics["checked_out"] = max(metrics["checked_out"] - 1, 0)
+
+    _metrics[engine] = metrics
+    return engine
+
+
+def get_engine(url=None):
+    """
+    Process-wide engine of url (DATABASE_URL by default), shared by every
+    task and view so connections are pooled instead of opened per call.
+    Pool sizing comes from DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_TIMEOUT.
+    """
+    url = url or os.environ["DATABASE_URL"]
+    with _lock:
+        if url not in _engines:
+            _engines[url] = _create(url)
+        return _engines[url]
+
+
+def pool_metrics(url=None):
+    """
+    Checkout counters of the engine of url, with the pool's own status
+    """
+    engine = get_engine(url)
+    out = dict(_metrics[engine])
+    out["status"] = engine.pool.status()
+    return out
@@ -1,21 +1,375 @@
-from luigi import Target
-from sqlalchemy import engine
+import os
+import threading
+import time
+from datetime import date
+import pandas as pd
+from luigi import Config, Target
+from luigi.parameter import BoolParameter, FloatParameter
+from sqlalchemy import engine, event
+
+# long tables holding every ticker, by the suffix of the per-ticker table
+LONG_TABLES = {"": "ticker_data", "_predict": "ticker_predict"}
+
+
+def sql_date(day):
+    # pandas stores datetimes in sqlite as text in this format, so dates
+    # have to be formatted the same way to compare
+    return pd.Timestamp(day).strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class storage(Config):
+    """
+    How ticker data is stored: one table per ticker ({ticker} and
+    {ticker}_predict), or with long_table all tickers in the LONG_TABLES,
+    keyed by (ticker, Date). Set in luigi.cfg:
+        [storage]
+        long_table = true
+    """
+
+    long_table = BoolParameter(default=False)
+    # seconds a catalog snapshot is trusted for writes of other processes
+    catalog_ttl = FloatParameter(default=10.0)
+
+
+def has_table(con, table: str):
+    query = "SELECT name FROM sqlite_master WHERE type='table' AND name=?"
+    return con.execute(query, (table,)).fetchone() is not None
+
+
+def has_ticker(con, table: str, ticker: str):
+    query = "SELECT 1 FROM {} WHERE ticker = ? LIMIT 1".format(table)
+    return con.execute(query, (ticker,)).fetchone() is not None
+
+
+class Catalog:
+    """
+    Snapshot of a database's tables, the tickers of its long tables and its
+    watermarks. Targets answer exists() from the snapshot, so scheduling
+    every task of LoadAllData costs one round of catalog queries instead
+    of one query per target. A snapshot is dropped on any write or commit
+    through an engine of the database, and expires after
+    storage.catalog_ttl seconds for writes of other processes. Snapshots
+    belong to one process, a forked child starts without any.
+    """
+
+    _snapshots = {}
+    _pid = os.getpid()
+    _watched = set()
+    _lock = threading.Lock()
+    refreshes = 0
+
+    def __init__(self, eng: engine.Engine):
+        self.tables = {
+            name
+            for (name,) in eng.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            )
+        }
+        self.tickers = {
+            table: {
+                ticker
+                for (ticker,) in eng.execute(
+                    "SELECT DISTINCT ticker FROM {}".format(table)
+                )
+            }
+            for table in LONG_TABLES.values()
+            if table in self.tables
+        }
+        self.watermarks = {}
+        if "watermarks" in self.tables:
+            self.watermarks = {
+                name: date.fromisoformat(day)
+                for name, day in eng.execute("SELECT name, date FROM watermarks")
+            }
+        self.fingerprints = {}
+        if "fingerprints" in self.tables:
+            self.fingerprints = dict(
+                eng.execute("SELECT name, fingerprint FROM fingerprints").fetchall()
+            )
+        self.expires = time.monotonic() + storage().catalog_ttl
+
+    @classmethod
+    def get(cls, eng):
+        """
+        Current snapshot of the database of eng, refreshed when needed
+        """
+        eng = getattr(eng, "engine", eng)
+        key = str(eng.url)
+        cls._watch(eng, key)
+        with cls._lock:
+            if cls._pid != os.getpid():
+                cls._snapshots, cls._pid = {}, os.getpid()
+            snapshot = cls._snapshots.get(key)
+            if snapshot is None or time.monotonic() > snapshot.expires:
+                snapshot = cls._snapshots[key] = cls(eng)
+                Catalog.refreshes += 1
+            return snapshot
+
+    @classmethod
+    def invalidate(cls, key=None):
+        with cls._lock:
+            if key is None:
+                cls._snapshots.clear()
+            else:
+                cls._snapshots.pop(key, None)
+
+    @classmethod
+    def _forked(cls):
+        # the lock may have been held by a thread the child does not have
+        cls._lock = threading.Lock()
+        cls._snapshots, cls._pid = {}, os.getpid()
+
+    @classmethod
+    def _watch(cls, eng, key):
+        if eng in cls._watched:
+            return
+        cls._watched.add(eng)
+
+        @event.listens_for(eng, "after_cursor_execute")
+        def write(con, cursor, statement, *args):
+            if statement.lstrip()[:6].upper() not in ("SELECT", "PRAGMA"):
+                cls.invalidate(key)
+
+        @event.listens_for(eng, "commit")
+        def commit(con):
+            cls.invalidate(key)
+
+
+# luigi runs tasks in forked processes, which must not trust the parent's
+os.register_at_fork(after_in_child=Catalog._forked)
 
 
 class SQLiteTableTarget(Target):
     """
     Luigi target of SQLite database tables
+    ticker: the target is the rows of this ticker in a long table
+    fingerprint: callable giving the fingerprint the data must have been
+    recorded with (see Fingerprinted), stale data does not exist
     """
 
-    def __init__(self, table: str, eng: engine.Engine):
+    def __init__(
+        self, table: str, eng: engine.Engine, ticker: str = None, fingerprint=None
+    ):
         super().__init__()
         self._table = table
         self._eng = eng
+        self._ticker = ticker
+        self._fingerprint = fingerprint
+        self.key = table if ticker is None else "{}/{}".format(table, ticker)
 
     def exists(self):
         """
         Override exists method. Luigi will check to see if task needs to run
         """
-        query = """SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}' """
-        query_set = self._eng.execute(query.format(table_name=self._table))
-        return query_set.fetchone() is not None
+        catalog = Catalog.get(self._eng)
+        stored = self._table in catalog.tables and (
+            self._ticker is None or self._ticker in catalog.tickers[self._table]
+        )
+        if stored and self._current(catalog.fingerprints.get(self.key)):
+            return True
+        # another process may have written it since the snapshot, only the
+        # positive answers of a snapshot are trusted
+        with self._eng.connect() as con:
+            if not has_table(con, self._table):
+                return False
+            if self._ticker is not None and not has_ticker(
+                con, self._table, self._ticker
+            ):
+                return False
+            if self._fingerprint is None:
+                return True
+            recorded = None
+            if has_table(con, "fingerprints"):
+                recorded = con.execute(
+                    "SELECT fingerprint FROM fingerprints WHERE name = ?", (self.key,)
+                ).scalar()
+            return self._current(recorded)
+
+    def _current(self, recorded):
+        # whether data recorded with this fingerprint is up to date
+        if self._fingerprint is None:
+            return True
+        return recorded is not None and recorded == self._fingerprint()
+
+    def record(self, con):
+        """
+        Record the fingerprint of the data, in the transaction writing it
+        """
+        if self._fingerprint is None:
+            return
+        con.execute("""CREATE TABLE IF NOT EXISTS fingerprints (
+               name TEXT PRIMARY KEY, fingerprint TEXT NOT NULL)""")
+        con.execute(
+            "INSERT OR REPLACE INTO fingerprints VALUES (?, ?)",
+            (self.key, self._fingerprint()),
+        )
+
+
+class TickerTable:
+    """
+    Rows of one ticker: the ticker's own table, or its rows of a long table
+    shared by all tickers (see storage)
+    suffix: "" for cleaned data, "_predict" for predictions
+    """
+
+    def __init__(self, ticker: str, eng: engine.Engine, suffix="", long=None):
+        self.ticker = ticker
+        self.eng = eng
+        self.long = storage().long_table if long is None else long
+        self.name = LONG_TABLES[suffix] if self.long else ticker + suffix
+
+    def target(self, fingerprint=None):
+        return SQLiteTableTarget(
+            self.name, self.eng, self.ticker if self.long else None, fingerprint
+        )
+
+    def _where(self, where=None, params=()):
+        clauses = (["ticker = ?"] if self.long else []) + ([where] if where else [])
+        sql = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return sql, ((self.ticker,) if self.long else ()) + tuple(params)
+
+    def select(self, columns="*", where=None, params=(), tail=""):
+        """
+        Parameterized query of the ticker's rows, as (sql, params)
+        """
+        sql, params = self._where(where, params)
+        return "SELECT {} FROM {}{}{}".format(columns, self.name, sql, tail), params
+
+    def read(self, columns="*", where=None, params=(), tail="", **kwargs):
+        """
+        Frame of the ticker's rows, without the ticker column
+        """
+        sql, params = self.select(columns, where, params, tail)
+        out = pd.read_sql_query(sql, con=self.eng, params=params, **kwargs)
+        return out.drop(columns="ticker", errors="ignore")
+
+    def delete(self, con, where=None, params=()):
+        sql, params = self._where(where, params)
+        con.execute("DELETE FROM {}{}".format(self.name, sql), params)
+
+    def write(self, con, frame, replace=True):
+        """
+        Store frame as the ticker's rows (replace) or add it to them, in the
+        caller's transaction, so a bulk load commits once
+        """
+        if not self.long:
+            frame.to_sql(
+                self.name,
+                con=con,
+                if_exists="replace" if replace else "append",
+                index=False,
+            )
+            # replace drops the index with the table
+            con.execute(
+                'CREATE INDEX IF NOT EXISTS "{0}_date" ON "{0}" (Date)'.format(
+                    self.name
+                )
+            )
+            return
+        frame = frame.copy()
+        frame.insert(0, "ticker", self.ticker)
+        if not has_table(con, self.name):
+            # clustered on (ticker, Date), so a ticker is one range scan
+            schema = pd.io.sql.get_schema(
+                frame, self.name, keys=["ticker", "Date"], con=con
+            )
+            con.execute(schema.rstrip() + " WITHOUT ROWID")
+        elif replace:
+            self.delete(con)
+        frame.to_sql(self.name, con=con, if_exists="append", index=False)
+
+    @staticmethod
+    def stored(tickers, eng: engine.Engine, suffix=""):
+        """
+        The tickers of tickers with rows stored, from the catalog
+        """
+        catalog = Catalog.get(eng)
+        long = storage().long_table
+        table = LONG_TABLES[suffix]
+        if long:
+            rows = catalog.tickers.get(table, set())
+            known = {ticker for ticker in tickers if ticker in rows}
+        else:
+            known = {ticker for ticker in tickers if ticker + suffix in catalog.tables}
+        if all(ticker in known for ticker in tickers):
+            return list(tickers)
+        # misses are checked in the database, another process may have
+        # written them since the snapshot
+        with eng.connect() as con:
+            if long:
+                live = has_table(con, table)
+                return [
+                    ticker
+                    for ticker in tickers
+                    if ticker in known or live and has_ticker(con, table, ticker)
+                ]
+            return [
+                ticker
+                for ticker in tickers
+                if ticker in known or has_table(con, ticker + suffix)
+            ]
+
+    @staticmethod
+    def read_many(tickers, eng: engine.Engine, suffix="", columns="*", **kwargs):
+        """
+        Rows of many tickers with a ticker column: one indexed scan of the
+        long table, or one read per ticker table
+        """
+        if not storage().long_table:
+            frames = {
+                ticker: TickerTable(ticker, eng, suffix, long=False).read(
+                    columns, **kwargs
+                )
+                for ticker in tickers
+            }
+            out = pd.concat(frames, names=["ticker", None]).reset_index(level=0)
+            return out.reset_index(drop=True)
+        tickers = list(tickers)
+        sql = "SELECT {} FROM {} WHERE ticker IN ({}) ORDER BY ticker, Date".format(
+            columns if columns == "*" else "ticker, " + columns,
+            LONG_TABLES[suffix],
+            ", ".join("?" * len(tickers)),
+        )
+        return pd.read_sql_query(sql, con=eng, params=tuple(tickers), **kwargs)
+
+
+def get_watermark(eng: engine.Engine, table: str):
+    """
+    Last date whose data is stored in table (a ticker's data in a long
+    table is keyed by the ticker), None if never loaded
+    """
+    if not has_table(eng, "watermarks"):
+        return None
+    row = eng.execute("SELECT date FROM watermarks WHERE name = ?", (table,)).fetchone()
+    return None if row is None else date.fromisoformat(row[0])
+
+
+def set_watermark(con, table: str, day: date):
+    """
+    Record the high-water mark of table, inside the caller's transaction
+    """
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS watermarks (name TEXT PRIMARY KEY, date TEXT)"
+    )
+    con.execute(
+        """INSERT INTO watermarks VALUES (?, ?)
+           ON CONFLICT(name) DO UPDATE SET date = excluded.date""",
+        (table, day.isoformat()),
+    )
+
+
+class SQLiteWatermarkTarget(SQLiteTableTarget):
+    """
+    Luigi target of a table loaded at least up to a date
+    """
+
+    def __init__(self, table: str, eng: engine.Engine, day: date, ticker=None):
+        super().__init__(table, eng, ticker)
+        self._day = day
+
+    def exists(self):
+        if not super().exists():
+            return False
+        catalog = Catalog.get(self._eng)
+        watermark = catalog.watermarks.get(self._ticker or self._table)
+        return watermark is not None and watermark >= self._day
@@ -0,0 +1,209 @@
+import logging
+import os
+import re
+import tempfile
+import time
+import fsspec
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import date, datetime
+from pandas.io.parsers import TextParser
+
+logger = logging.getLogger(__name__)
+
+
+def _convert(value):
+    # same cell conversion pandas' openpyxl reader does before parsing
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    # calamine reads date-only cells as dates, openpyxl as datetimes
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _frame(rows, names, parse_dates):
+    """
+    Turn a batch of raw rows into a frame the way read_excel would
+    """
+    width = len(names)
+    rows = [row[:width] + [""] * (width - len(row)) for row in rows]
+    return TextParser(rows, names=names, parse_dates=parse_dates).read()
+
+
+def excel_engine():
+    """
+    Fastest excel reader installed: calamine (python-calamine, a Rust
+    reader) when available, otherwise openpyxl
+    """
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return "openpyxl"
+    return "calamine"
+
+
+def read_sheet(src, sheet_name="Stream", parse_dates=("Date",), engine=None):
+    """
+    Read one sheet into the same frame pd.read_excel would give
+    """
+    engine = engine or excel_engine()
+    if engine != "calamine":
+        return pd.read_excel(
+            src, sheet_name=sheet_name, parse_dates=list(parse_dates), engine=engine
+        )
+    from python_calamine import CalamineWorkbook
+
+    sheet = CalamineWorkbook.from_path(src).get_sheet_by_name(sheet_name)
+    rows = [[_convert(x) for x in row] for row in sheet.to_python()]
+    while rows and all(x == "" for x in rows[-1]):
+        rows.pop()
+    names = [str(x) for x in rows[0]] if rows else []
+    return _frame(rows[1:], names, [x for x in parse_dates if x in names])
+
+
+def export_ticker(file):
+    """
+    Ticker of a twitter dashboard export, e.g. export_dashboard_aapl_2016.xlsx
+    """
+    match = re.match(
+        r"export_dashboard_([A-Za-z0-9.\-]+?)(_|\.xlsx$)", os.path.basename(file)
+    )
+    return match.group(1).lower() if match else None
+
+
+def export_files(files):
+    """
+    {ticker: file} of twitter dashboard exports. Files not named like one are
+    skipped, two exports of the same ticker raise a ValueError
+    """
+    exports = {}
+    for file in sorted(files):
+        ticker = export_ticker(file)
+        if ticker is None:
+            logger.warning("skipped %s, not named like an export", file)
+        elif ticker in exports:
+            raise ValueError(
+                "two exports of {}: {} and {}".format(ticker, exports[ticker], file)
+            )
+        else:
+            exports[ticker] = file
+    return exports
+
+
+def convert_export(src, dst, engine=None):
+    """
+    Convert one export's Stream sheet to parquet, return the seconds taken
+    """
+    start = time.perf_counter()
+    read_sheet(src, engine=engine).to_parquet(dst)
+    return time.perf_counter() - start
+
+
+def _table(frame):
+    """
+    Arrow table of a parsed batch. Object columns mixing numbers and text,
+    which arrow refuses, are stored as text
+    """
+    for name in frame.columns[frame.dtypes == object]:
+        try:
+            pa.array(frame[name], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            frame[name] = frame[name].map(lambda x: x if pd.isnull(x) else str(x))
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def _unify(schemas):
+    """
+    Common schema of every batch: int batches of a float column become
+    float, mixed columns become strings, and all-empty columns become float
+    (as read_excel gives NaN)
+    """
+    fields = []
+    for name in schemas[0].names:
+        types = [s.field(name).type for s in schemas]
+        known = [t for t in types if t != pa.null()]
+        if not known:
+            kind = pa.float64()
+        elif all(t == known[0] for t in known):
+            kind = known[0]
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in known):
+            kind = pa.float64()
+        else:
+            kind = pa.string()
+        fields.append(pa.field(name, kind))
+    return pa.schema(fields)
+
+
+def _to_string(column):
+    # cast that also works for types arrow cannot cast to string directly
+    return pa.array(
+        [None if x is None else str(x) for x in column.to_pylist()], pa.string()
+    )
+
+
+def excel_to_parquet(
+    src, dst, sheet_name="Stream", row_group_size=50000, parse_dates=("Date",)
+):
+    """
+    Convert one excel sheet to parquet with bounded memory.
+    The sheet is read row by row in read-only mode. Every row_group_size rows
+    are parsed and spilled to a temporary parquet file. The spilled batches
+    are then cast to one common schema and written as row groups of dst, so
+    only one batch is held in memory at a time.
+    """
+    book = openpyxl.load_workbook(src, read_only=True, data_only=True)
+    try:
+        rows = book[sheet_name].iter_rows(values_only=True)
+        names = [str(x) for x in next(rows, ())]
+        dates = [x for x in parse_dates if x in names]
+        with tempfile.TemporaryDirectory() as tmp:
+            spilled, schemas, batch, empty = [], [], [], []
+
+            def spill():
+                table = _table(_frame(batch, names, dates))
+                path = os.path.join(tmp, "{}.parquet".format(len(spilled)))
+                pq.write_table(table, path)
+                spilled.append(path)
+                schemas.append(table.schema)
+                batch.clear()
+
+            for row in rows:
+                row = [_convert(x) for x in row]
+                # read_excel drops trailing empty rows, keep them until a
+                # non empty row shows they are not trailing
+                if all(x == "" for x in row):
+                    empty.append(row)
+                    continue
+                batch.extend(empty)
+                empty.clear()
+                batch.append(row)
+                if len(batch) >= row_group_size:
+                    spill()
+            if batch or not spilled:
+                spill()
+            # pandas metadata describes one batch only, leave it out
+            schema = _unify(schemas)
+
+            with fsspec.open(dst, "wb") as f, pq.ParquetWriter(f, schema) as writer:
+                for path in spilled:
+                    table = pq.read_table(path)
+                    columns = [
+                        (
+                            _to_string(table[field.name])
+                            if field.type == pa.string()
+                            and table.schema.field(field.name).type != pa.string()
+                            else table[field.name].cast(field.type)
+                        )
+                        for field in schema
+                    ]
+                    writer.write_table(
+                        pa.Table.from_arrays(columns, schema=schema),
+                        row_group_size=row_group_size,
+                    )
+    finally:
+        book.close()
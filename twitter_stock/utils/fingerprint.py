@@ -0,0 +1,86 @@
+import hashlib
+import json
+import time
+import fsspec
+from luigi import Config
+from luigi.parameter import FloatParameter
+from luigi.task import flatten
+
+
+class file_fingerprints(Config):
+    """
+    [file_fingerprints] section of luigi.cfg
+    """
+
+    # seconds the ETag of an object store file is trusted, so scheduling
+    # many tasks over the same files costs one request per file
+    etag_ttl = FloatParameter(default=10.0)
+
+
+_hashes = {}
+_etags = {}
+
+
+def file_fingerprint(path):
+    """
+    Content fingerprint of a file: the ETag of object stores, memoized for
+    file_fingerprints.etag_ttl seconds, otherwise the sha1 of the content,
+    memoized on (path, size, mtime). None if missing
+    """
+    etag = _etags.get(path)
+    if etag is not None and etag[0] > time.monotonic():
+        return etag[1]
+    fs, local = fsspec.core.url_to_fs(path)
+    try:
+        info = fs.info(local)
+    except FileNotFoundError:
+        return None
+    if info.get("ETag"):
+        etag = info["ETag"].strip('"')
+        _etags[path] = (time.monotonic() + file_fingerprints().etag_ttl, etag)
+        return etag
+    key = (path, info.get("size"), info.get("mtime"))
+    if key not in _hashes:
+        digest = hashlib.sha1()
+        with fs.open(local, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        _hashes[key] = digest.hexdigest()
+    return _hashes[key]
+
+
+class Fingerprinted:
+    """
+    Mixin of tasks whose output records a fingerprint of what it is built
+    from: the significant parameters, code_version and the inputs, i.e. the
+    fingerprints of fingerprinted dependencies and the content of the files
+    of the others. Bump code_version when a change of the code changes the
+    output.
+    """
+
+    code_version = 1
+    # parameters that change how, not what, the output is built
+    fingerprint_exclude = ()
+
+    def fingerprint(self, deps=None):
+        """
+        Fingerprint the output should have, None while an input is missing
+        deps: dependencies the output is built from, self.requires() by default
+        """
+        params = self.to_str_params(only_significant=True)
+        for name in self.fingerprint_exclude:
+            params.pop(name, None)
+        parts = [self.code_version, params]
+        for dep in flatten(self.requires() if deps is None else deps):
+            if isinstance(dep, Fingerprinted):
+                part = [dep.fingerprint()]
+            else:
+                part = [
+                    file_fingerprint(target.path)
+                    for target in flatten(dep.output())
+                    if hasattr(target, "path")
+                ]
+            if None in part:
+                return None
+            parts.extend(part)
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
@@ -1,31 +1,281 @@
+import json
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-import os
+from .db import get_engine
+from .db_target import Catalog, TickerTable, has_table
 
 # import matplotlib.pyplot as plt
 
 
-def graph(ticker):
+def nav_curves(data):
     """
-    Helper function to return data for graphing
+    nav of holding the stock and nav_strategy of trading the predicted
+    signals, from the Date, pct_change and signal_predict of a ticker
     """
-    engine = create_engine(os.environ["DATABASE_URL"])
-    data = pd.read_sql_query(
-        """SELECT Date, pct_change, signal_predict FROM {}_predict""".format(ticker),
-        con=engine,
-        parse_dates=["Date"],
+    pct_change = data["pct_change"].reset_index(drop=True)
+    pct_change.iloc[0] = 0.0
+    # trade on the day after the prediction, short on SELL
+    signal = data["signal_predict"].reset_index(drop=True)
+    signal = signal.replace(0, -1).shift(1, fill_value=0)
+    return pd.DataFrame(
+        {
+            "Date": data["Date"].reset_index(drop=True),
+            "nav": pct_change.cumsum(),
+            "nav_strategy": (pct_change * signal).cumsum(),
+        }
+    )
+
+
+def curves_json(curves):
+    """
+    The /mygraph/ payload of the curves
+    """
+    return json.dumps(
+        {
+            "date": curves["Date"].astype(str).to_list(),
+            "nav": curves["nav"].to_list(),
+            "nav_strategy": curves["nav_strategy"].to_list(),
+        }
     )
-    data.iloc[0, 1] = 0.0
-    data["signal_predict"] = (
-        data["signal_predict"].replace(0, -1).shift(1, fill_value=0)
+
+
+def store_curves(con, ticker, curves):
+    """
+    Materialize the curves of ticker in nav_curves, one row per ticker: the
+    days since epoch (int32) and both curves (float64) as arrays, and the
+    payload /mygraph/ serves
+    """
+    days = curves["Date"].to_numpy().astype("datetime64[D]").astype(np.int32)
+    con.execute("""CREATE TABLE IF NOT EXISTS nav_curves (
+           ticker TEXT PRIMARY KEY, days BLOB NOT NULL, nav BLOB NOT NULL,
+           nav_strategy BLOB NOT NULL, payload TEXT NOT NULL)""")
+    con.execute(
+        "INSERT OR REPLACE INTO nav_curves VALUES (?, ?, ?, ?, ?)",
+        (
+            ticker,
+            days.tobytes(),
+            curves["nav"].to_numpy(np.float64).tobytes(),
+            curves["nav_strategy"].to_numpy(np.float64).tobytes(),
+            curves_json(curves),
+        ),
     )
-    data["nav"] = data["pct_change"].cumsum()
-    data["nav_strategy"] = (data["pct_change"] * data["signal_predict"]).cumsum()
+
+
+def read_curves(ticker, columns="payload", eng=None):
+    """
+    Row of the materialized curves of ticker, None if not materialized
+    """
+    eng = eng or get_engine()
+    # a miss of the snapshot is checked, another process may have written it
+    if "nav_curves" not in Catalog.get(eng).tables and not has_table(
+        eng, "nav_curves"
+    ):
+        return None
+    return eng.execute(
+        "SELECT {} FROM nav_curves WHERE ticker = ?".format(columns), (ticker,)
+    ).fetchone()
+
+
+def predict_curves(ticker):
+    """
+    Curves of ticker computed from its stored predictions
+    """
+    engine = get_engine()
+    data = TickerTable(ticker, engine, "_predict").read(
+        "Date, pct_change, signal_predict", parse_dates=["Date"]
+    )
+    return nav_curves(data)
+
+
+def batch_curves(tickers, eng=None):
+    """
+    nav and nav_strategy of many tickers in one pass over their stored
+    predictions, as (date x ticker) frames on the union of their dates,
+    NaN where a ticker has no prediction. Each column is the nav_curves of
+    its ticker.
+    """
+    eng = eng or get_engine()
+    data = TickerTable.read_many(
+        tickers,
+        eng,
+        "_predict",
+        "Date, pct_change, signal_predict",
+        parse_dates=["Date"],
+    )
+    by_ticker = data.groupby("ticker", sort=False)
+    pct_change = data["pct_change"].mask(by_ticker.cumcount() == 0, 0.0)
+    # trade on the day after the prediction, short on SELL
+    signal = data["signal_predict"].replace(0, -1).groupby(data["ticker"])
+    signal = signal.shift(1).fillna(0)
+    data = data.assign(nav=pct_change, nav_strategy=pct_change * signal)
+    matrix = data.pivot(index="Date", columns="ticker").cumsum()
+    return matrix["nav"][tickers], matrix["nav_strategy"][tickers]
+
+
+def materialized_curves(tickers, eng):
+    """
+    nav and nav_strategy of the tickers whose curves are materialized, as
+    batch_curves, from one read of their arrays
+    """
+    rows = []
+    if tickers and "nav_curves" in Catalog.get(eng).tables:
+        rows = eng.execute(
+            "SELECT ticker, days, nav, nav_strategy FROM nav_curves "
+            "WHERE ticker IN ({})".format(", ".join("?" * len(tickers))),
+            tuple(tickers),
+        ).fetchall()
+    days = [np.frombuffer(row[1], dtype=np.int32) for row in rows]
+    dates = np.unique(np.concatenate(days)) if rows else np.array([], np.int32)
+    navs = np.full((2, len(dates), len(rows)), np.nan)
+    for column, (row, ticker_days) in enumerate(zip(rows, days)):
+        at = np.searchsorted(dates, ticker_days)
+        navs[0, at, column] = np.frombuffer(row[2])
+        navs[1, at, column] = np.frombuffer(row[3])
+    index = pd.DatetimeIndex(dates.astype("datetime64[D]"), name="Date")
+    columns = pd.Index([row[0] for row in rows], name="ticker")
+    return tuple(pd.DataFrame(nav, index=index, columns=columns) for nav in navs)
+
+
+def batch_json(tickers):
+    """
+    /mygraphs/ payload: the dates, the tickers whose predictions are stored,
+    and per ticker its nav and nav_strategy aligned on the dates (null where
+    it has none), and the tickers without predictions
+    """
+    eng = get_engine()
+    found = TickerTable.stored(tickers, eng, "_predict")
+    nav, nav_strategy = materialized_curves(found, eng)
+    computed = [ticker for ticker in found if ticker not in nav.columns]
+    if computed:
+        # analyzed before the curves were materialized
+        more = batch_curves(computed, eng)
+        nav, nav_strategy = (
+            pd.concat([stored, new], axis=1).sort_index()
+            for stored, new in zip((nav, nav_strategy), more)
+        )
+    nav, nav_strategy = nav[found], nav_strategy[found]
+    # to_json writes NaN as null, and the matrices without a Python list
+    fields = {
+        "date": json.dumps(nav.index.astype(str).to_list()),
+        "tickers": json.dumps(found),
+        "nav": nav.T.to_json(orient="values", double_precision=15),
+        "nav_strategy": nav_strategy.T.to_json(orient="values", double_precision=15),
+        "missing": json.dumps([ticker for ticker in tickers if ticker not in found]),
+    }
+    return "{" + ", ".join('"{}": {}'.format(*field) for field in fields.items()) + "}"
+
+
+def graph(ticker):
+    """
+    Helper function to return data for graphing
+    """
+    curves = predict_curves(ticker)
     # df = data[['nav', 'nav_strategy']]
     # df.plot()
     # plt.show()
     # engine.disposal
-    date = data["Date"].astype(str).to_list()
-    nav = data["nav"].to_list()
-    nav_strategy = data["nav_strategy"].to_list()
+    date = curves["Date"].astype(str).to_list()
+    nav = curves["nav"].to_list()
+    nav_strategy = curves["nav_strategy"].to_list()
     return date, nav, nav_strategy
+
+
+def lttb(x, y, points):
+    """
+    Indices of the largest-triangle-three-buckets downsampling of the columns
+    of y over x to points points, the triangle areas summed over the columns
+    so both curves keep the same dates
+    """
+    n = len(x)
+    if points < 3:
+        raise ValueError("at least 3 points")
+    if points >= n:
+        return np.arange(n)
+    # the first and last points are kept, the rest split in points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    # the third vertex of the triangles of a bucket is the average of the
+    # next one, the last point for the last bucket
+    counts = np.append(np.diff(edges), 1)[1:]
+    cx = np.add.reduceat(x[1:], edges - 1)[1:] / counts
+    cy = np.add.reduceat(y[1:], edges - 1)[1:] / counts[:, None]
+    index = np.empty(points, dtype=int)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        area = np.abs(
+            (x[a] - cx[i]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi, None]) * (cy[i] - y[a])
+        ).sum(axis=1)
+        a = lo + area.argmax()
+        index[i + 1] = a
+    return index
+
+
+def curve_blobs(ticker):
+    """
+    The days since epoch (int32), nav and nav_strategy (float64) arrays of
+    the curves of ticker as bytes, read from nav_curves when materialized
+    """
+    row = read_curves(ticker, "days, nav, nav_strategy")
+    if row is not None:
+        return tuple(row)
+    curves = predict_curves(ticker)
+    days = curves["Date"].to_numpy().astype("datetime64[D]").astype(np.int32)
+    return (
+        days.tobytes(),
+        curves["nav"].to_numpy(np.float64).tobytes(),
+        curves["nav_strategy"].to_numpy(np.float64).tobytes(),
+    )
+
+
+@lru_cache(maxsize=32)
+def encode_curves(days, nav, nav_strategy, points, format):
+    """
+    Payload of the curve blobs, memoized on their bytes so repeated reads of
+    unchanged curves skip the downsampling
+    """
+    days = np.frombuffer(days, dtype=np.int32)
+    navs = np.column_stack([np.frombuffer(nav), np.frombuffer(nav_strategy)])
+    if points is not None:
+        index = lttb(days.astype(np.float64), navs, points)
+        days, navs = days[index], navs[index]
+    if format == "json":
+        curves = pd.DataFrame(navs, columns=["nav", "nav_strategy"])
+        curves["Date"] = days.astype("datetime64[D]")
+        return curves_json(curves)
+    payload = np.uint32(len(days)).astype("<u4").tobytes()
+    payload += days.astype("<i4").tobytes()
+    payload += navs.T.astype("<f4").tobytes()
+    return payload
+
+
+def graph_payload(ticker, points=None, format="json"):
+    """
+    /mygraph/ payload of ticker and its content type, downsampled to points
+    points. format "json" is the date strings and float lists, "binary" the
+    little-endian uint32 point count followed by the int32 days since epoch,
+    then the float32 nav and nav_strategy.
+    """
+    if format not in ("json", "binary"):
+        raise ValueError("unknown format {}".format(format))
+    if points is not None and points < 3:
+        raise ValueError("at least 3 points")
+    if format == "json" and points is None:
+        return graph_json(ticker), "application/json"
+    payload = encode_curves(*curve_blobs(ticker), points, format)
+    if format == "json":
+        return payload, "application/json"
+    return payload, "application/octet-stream"
+
+
+def graph_json(ticker):
+    """
+    /mygraph/ payload of ticker: one keyed read of the curves materialized
+    by Analyze, computed from the predictions for tables analyzed before
+    """
+    row = read_curves(ticker)
+    if row is not None:
+        return row[0]
+    return curves_json(predict_curves(ticker))
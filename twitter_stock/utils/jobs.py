@@ -0,0 +1,334 @@
+import copy
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from luigi import Task, build
+from luigi.event import Event
+from luigi.execution_summary import LuigiStatusCode
+from luigi.task_register import Register
+from .db_target import Catalog
+from .results import django_cache
+
+logger = logging.getLogger(__name__)
+
+# set in every worker process by _init_worker
+_events = None
+_job = None
+
+
+def _report(**event):
+    _events.put(dict(event, job=_job, time=time.time()))
+
+
+def _task_event(name, task, *args, **fields):
+    _report(
+        event=name,
+        task=task.task_id,
+        family=task.task_family,
+        params=task.to_str_params(only_significant=True),
+        **fields
+    )
+
+
+def _init_worker(events):
+    """
+    Report the luigi events of every task the worker process runs
+    """
+    global _events
+    _events = events
+    handlers = {
+        Event.DEPENDENCY_PRESENT: "complete",
+        Event.DEPENDENCY_MISSING: "missing",
+        Event.START: "started",
+        Event.SUCCESS: "succeeded",
+        Event.FAILURE: "failed",
+    }
+    for event, name in handlers.items():
+        Task.event_handler(event)(partial(_task_event, name))
+
+    @Task.event_handler(Event.PROCESSING_TIME)
+    def processing_time(task, duration):
+        _task_event("duration", task, duration=duration)
+
+
+def _schedule(tasks):
+    """
+    Report every task of the build that is not complete yet once, before
+    luigi runs them; luigi has no event for a pending task
+    """
+    seen, stack = set(), list(tasks)
+    while stack:
+        task = stack.pop()
+        if task.task_id in seen:
+            continue
+        seen.add(task.task_id)
+        try:
+            # external tasks do not run, luigi reports them missing
+            pending = task.run is not None and not task.complete()
+        except Exception:
+            # luigi reports the failed check
+            continue
+        if pending:
+            _task_event("scheduled", task)
+            stack.extend(task.deps())
+
+
+def _run(job, tasks):
+    global _job
+    _job = job
+    _report(event="job", status="running")
+    _schedule(tasks)
+    result = build(tasks, local_scheduler=True, detailed_summary=True)
+    # after the events of the tasks on the same queue
+    _report(event="job", status="finished", result=result.status.name)
+
+
+def _after_job(event):
+    """
+    Run the after_job method, if any, of a task that succeeded in a worker
+    process, so the submitting process can drop what the task made stale
+    """
+    try:
+        task = Register.get_task_cls(event["family"]).from_str_params(event["params"])
+        after_job = getattr(task, "after_job", None)
+        if after_job is not None:
+            after_job()
+    except Exception:
+        logger.exception("after_job of %s failed", event["task"])
+
+
+class JobQueue:
+    """
+    Runs luigi builds in a pool of worker processes: submit returns a job id
+    at once, status reports the job's progress and follow streams its events.
+    Workers report the events of each task over a multiprocessing queue, so
+    no broker is needed. Job state lives in the memory of the submitting
+    process and its status is published to the Django cache, so every
+    process of a multi-worker server can report it. Jobs finished for
+    retention seconds are dropped from memory, their status stays in the
+    cache.
+    """
+
+    def __init__(self, workers: int = None, cache=None, retention: float = None):
+        self.workers = workers or int(os.environ.get("JOB_WORKERS", 2))
+        if retention is None:
+            retention = float(os.environ.get("JOB_RETENTION", 3600))
+        self.retention = retention
+        self._cache = cache
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._pool = ProcessPoolExecutor(
+            self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._events,),
+        )
+        self._jobs = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        # notified whenever a job changes
+        self._changed = threading.Condition(self._lock)
+        # keeps a slow publish from overwriting a newer status
+        self._publishing = threading.Lock()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def submit(self, tasks):
+        """
+        Queue a build of tasks, return the job id
+        """
+        job = uuid.uuid4().hex
+        with self._lock:
+            self._prune()
+            self._jobs[job] = {
+                "id": job,
+                "status": "queued",
+                "requested": [str(task) for task in tasks],
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "result": None,
+                "tasks": {},
+                "events": [],
+            }
+            future = self._pool.submit(_run, job, list(tasks))
+            self._futures[job] = future
+        future.add_done_callback(partial(self._done, job))
+        self._publish(job)
+        logger.info("job %s queued: %s", job, ", ".join(map(str, tasks)))
+        return job
+
+    def _prune(self):
+        # the caller holds the lock
+        expired = time.time() - self.retention
+        for job, state in list(self._jobs.items()):
+            if state["finished"] is not None and state["finished"] <= expired:
+                del self._jobs[job], self._futures[job]
+
+    def _listen(self):
+        while True:
+            event = self._events.get()
+            # before the job is seen done
+            if event["event"] == "succeeded":
+                # the catalogs of this process do not see the writes of a
+                # worker process
+                Catalog.invalidate()
+                _after_job(event)
+            with self._changed:
+                changed = self._apply(event)
+                self._changed.notify_all()
+            if changed:
+                self._publish(changed)
+
+    def _apply(self, event):
+        job = self._jobs.get(event.pop("job"))
+        if job is None:
+            return None
+        if event["event"] == "job":
+            if event["status"] == "running":
+                job["status"], job["started"] = "running", event["time"]
+            else:
+                self._finish(job, event["result"], event["time"])
+            return job["id"]
+        task = job["tasks"].setdefault(
+            event["task"],
+            dict(family=event["family"], status=None, started=None, finished=None),
+        )
+        name = event["event"]
+        if name == "duration":
+            task["duration"] = event["duration"]
+        elif name == "started":
+            task["status"], task["started"] = name, event["time"]
+        elif name in ("succeeded", "failed"):
+            task["status"], task["finished"] = name, event["time"]
+        elif task["status"] is None:
+            task["status"] = name
+        else:
+            # a pending task luigi found complete meanwhile
+            return None
+        job["events"].append(event)
+        return job["id"]
+
+    @staticmethod
+    def _finish(job, result, finished, error=None):
+        succeeded = result in (
+            LuigiStatusCode.SUCCESS.name,
+            LuigiStatusCode.SUCCESS_WITH_RETRY.name,
+        )
+        job["status"] = "done" if succeeded else "failed"
+        job["result"], job["finished"] = result, finished
+        job["started"] = job["started"] or job["submitted"]
+        if error:
+            job["error"] = error
+        logger.info("job %s %s: %s", job["id"], job["status"], result or error)
+
+    def _done(self, job, future):
+        # a build that did not report its end, e.g. a crashed worker process
+        error = future.exception()
+        if error is not None:
+            with self._changed:
+                self._finish(self._jobs[job], None, time.time(), repr(error))
+                self._changed.notify_all()
+            self._publish(job)
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = django_cache()
+        return self._cache
+
+    def _publish(self, job):
+        with self._publishing:
+            self.cache.set("job:{}".format(job), self.status(job), 24 * 3600)
+
+    def status(self, job):
+        """
+        State of the job with per-task progress and timing, None if unknown.
+        Jobs of other server processes are read from the cache
+        """
+        with self._lock:
+            state = copy.deepcopy(self._jobs.get(job))
+        if state is None:
+            return self.cache.get("job:{}".format(job))
+        del state["events"]
+        end = state["finished"] or time.time()
+        state["duration"] = end - state["started"] if state["started"] else None
+        progress = {}
+        for task in state["tasks"].values():
+            progress[task["status"]] = progress.get(task["status"], 0) + 1
+        state["progress"] = progress
+        return state
+
+    def owns(self, job):
+        """
+        Whether the job was submitted to this process
+        """
+        return job in self._jobs
+
+    def follow(self, job, keepalive: float = None):
+        """
+        Yield the task events of the job as they happen, from the first one
+        until the job finished. Yields None when nothing happened for
+        keepalive seconds. Only the process owning the job can follow it
+        """
+        state, seen = self._jobs[job], 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: len(state["events"]) > seen or state["finished"],
+                    keepalive,
+                )
+                events = state["events"][seen:]
+                finished = state["finished"] is not None
+            seen += len(events)
+            for event in events:
+                yield event
+            if finished:
+                return
+            if not events:
+                yield None
+
+    def wait(self, job, timeout: float = None):
+        """
+        Block until the job finished, return its status
+        """
+        future = self._futures.get(job)
+        if future is None:
+            # dropped after its retention, the cache has its final status
+            return self.status(job)
+        future.exception(timeout)
+        # the end of the build may still be on the event queue
+        while self.status(job)["finished"] is None:
+            time.sleep(0.01)
+        return self.status(job)
+
+    def run(self, tasks, timeout: float = None):
+        """
+        Build tasks in a worker process and wait for the end, return the
+        status of the job
+        """
+        return self.wait(self.submit(tasks), timeout)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+_queue = None
+_queue_pid = None
+_queue_lock = threading.Lock()
+
+
+def get_jobs():
+    """
+    Process-wide job queue, started on first use. A forked server worker
+    starts its own, the pool of the parent does not survive the fork.
+    """
+    global _queue, _queue_pid
+    with _queue_lock:
+        if _queue is None or _queue_pid != os.getpid():
+            _queue, _queue_pid = JobQueue(), os.getpid()
+        return _queue
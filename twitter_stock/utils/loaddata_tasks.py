@@ -2,15 +2,39 @@ import yfinance as yf
 import numpy as np
 import os
 import glob
-from sqlalchemy import create_engine
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from .db import get_engine
+from .fingerprint import Fingerprinted
+from .sentiment import SCORER_VERSION
 from luigi import Task
 from luigi.local_target import LocalTarget
 from luigi.contrib.s3 import S3Target
-from luigi.parameter import Parameter
-
-from .db_target import SQLiteTableTarget
+from luigi.parameter import (
+    Parameter,
+    IntParameter,
+    ListParameter,
+    ChoiceParameter,
+    BoolParameter,
+    DateParameter,
+)
+
+from .db_target import (
+    SQLiteTableTarget,
+    SQLiteWatermarkTarget,
+    TickerTable,
+    get_watermark,
+    set_watermark,
+    sql_date,
+)
+from .excel import excel_to_parquet, excel_engine, export_files, convert_export
+from .prices import FINANCE_WINDOW, yahoo_download, download_prices
 from .clean import *
 
+logger = logging.getLogger(__name__)
+
 
 s3_root = "s3://*****"  # add s3 bucket before running
 local_root = os.path.abspath("data")
@@ -35,12 +59,52 @@ class UploadFinanceData(Task):
 
     def run(self):
         finance = yf.download(
-            self.ticker, start="2016-04-01", end="2016-06-17", progress=False
+            self.ticker,
+            start=FINANCE_WINDOW[0],
+            end=FINANCE_WINDOW[1],
+            progress=False,
         )
         finance = finance.reset_index()
         finance.to_parquet(self.output().path)
 
 
+class UploadAllFinanceData(Task):
+    """
+    Pull stock data of many tickers through yfinance in batched calls, and
+    upload each ticker to its UploadFinanceData output.
+    example usage: UploadAllFinanceData(tickers=allcashtags)
+    """
+
+    tickers = ListParameter()
+    # tickers per yfinance call, and requests in flight within a call
+    batch_size = IntParameter(default=100, significant=False)
+    threads = IntParameter(default=16, significant=False)
+    # price provider, override with a fixture to run offline
+    download = staticmethod(yahoo_download)
+
+    def output(self):
+        return {
+            ticker.lower(): UploadFinanceData(ticker.lower()).output()
+            for ticker in self.tickers
+        }
+
+    def run(self):
+        todo = [
+            ticker for ticker, target in self.output().items() if not target.exists()
+        ]
+        prices = download_prices(
+            todo,
+            batch_size=self.batch_size,
+            threads=self.threads,
+            download=self.download,
+        )
+        for ticker, finance in prices.items():
+            finance.to_parquet(self.output()[ticker].path)
+        missing = sorted(set(todo) - set(prices))
+        if missing:
+            raise RuntimeError("no prices downloaded for {}".format(", ".join(missing)))
+
+
 class LocalTwitterData(Task):
     """
     Load from local 'TwitterData' directory
@@ -66,6 +130,9 @@ class UploadTwitterData(Task):
     """
 
     ticker = Parameter()
+    # stream the sheet into parquet row groups instead of loading it whole
+    streaming = BoolParameter(default=False, significant=False)
+    row_group_size = IntParameter(default=50000, significant=False)
 
     def requires(self):
         return LocalTwitterData(self.ticker)
@@ -80,10 +147,65 @@ class UploadTwitterData(Task):
         # )
 
     def run(self):
-        tmp = pd.read_excel(
-            self.input().path, sheet_name="Stream", parse_dates=["Date"]
+        if self.streaming:
+            excel_to_parquet(
+                self.input().path,
+                self.output().path,
+                sheet_name="Stream",
+                row_group_size=self.row_group_size,
+            )
+            return
+        convert_export(self.input().path, self.output().path)
+
+
+class UploadAllTwitterData(Task):
+    """
+    Convert every export under the local 'TwitterData' directory at once,
+    in a process pool and with the fastest excel engine installed.
+    Outputs are the UploadTwitterData outputs, so ExtracttoDB is unaffected.
+    example usage: UploadAllTwitterData(workers=8)
+    """
+
+    workers = IntParameter(default=os.cpu_count() or 1, significant=False)
+
+    def exports(self):
+        files = glob.glob(
+            os.path.join(local_root, "TwitterData", "export_dashboard_*.xlsx")
         )
-        tmp.to_parquet(self.output().path)
+        return export_files(files)
+
+    def output(self):
+        return {ticker: UploadTwitterData(ticker).output() for ticker in self.exports()}
+
+    def run(self):
+        exports = self.exports()
+        todo = {
+            ticker: target.path
+            for ticker, target in self.output().items()
+            if not target.exists()
+        }
+        engine = excel_engine()
+        self.timings = {}
+        with ProcessPoolExecutor(
+            max_workers=max(min(self.workers, len(todo)), 1),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as pool:
+            futures = {
+                pool.submit(convert_export, exports[ticker], path, engine): ticker
+                for ticker, path in todo.items()
+            }
+            for future in as_completed(futures):
+                ticker = futures[future]
+                self.timings[ticker] = future.result()
+                logger.info(
+                    "converted %s in %.2fs (%s)",
+                    os.path.basename(exports[ticker]),
+                    self.timings[ticker],
+                    engine,
+                )
+                self.set_status_message(
+                    "{}/{} exports converted".format(len(self.timings), len(todo))
+                )
 
 
 class LocalCashtags(Task):
@@ -119,13 +241,30 @@ class UploadCashtags(Task):
                 f.write("{}\n".format(item))
 
 
-class ExtracttoDB(Task):
+class ExtracttoDB(Fingerprinted, Task):
     """
-    Clean data and save to database
+    Clean data and save to database. The table records a fingerprint of the
+    parquet inputs and parameters, it is rebuilt only when they change
+    example usage: ExtracttoDB('aapl', incremental=True, twitter_end=today)
+                   #only clean and upsert what is new since the last run
     """
 
-    engine = create_engine(os.environ["DATABASE_URL"])
+    code_version = (1, SCORER_VERSION)
+    # an incremental run stores the same data as a full one
+    fingerprint_exclude = ("incremental",)
+
+    engine = get_engine()
+    # sentiment scores are cached across runs, so only new tweets are scored
+    sentiment_cache = os.path.join(local_root, "sentiment_cache.sqlite3")
     ticker = Parameter()
+    # tweets kept for cleaning, both dates inclusive
+    twitter_start = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[0]).date())
+    twitter_end = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[1]).date())
+    # process pool for sentiment scoring, e.g. --ExtracttoDB-sentiment-workers 8
+    sentiment_workers = IntParameter(default=1, significant=False)
+    sentiment_chunk_size = IntParameter(default=20000, significant=False)
+    # keep the stored history, only clean data after the ticker's watermark
+    incremental = BoolParameter(default=False)
 
     def requires(self):
         return {
@@ -133,15 +272,158 @@ class ExtracttoDB(Task):
             "finance": UploadFinanceData(self.ticker),
         }
 
+    def table(self):
+        return TickerTable(self.ticker, self.engine)
+
     def output(self):
-        return SQLiteTableTarget(table=self.ticker, eng=self.engine)
+        table = self.table()
+        if self.incremental:
+            return SQLiteWatermarkTarget(
+                table=table.name,
+                eng=self.engine,
+                day=self.twitter_end,
+                ticker=self.ticker if table.long else None,
+            )
+        return table.target(self.fingerprint)
+
+    def restart(self):
+        """
+        Stored rows an incremental run rewrites and what it needs to rebuild
+        them, or None when the whole table has to be rebuilt
+        """
+        table = self.table()
+        watermark = get_watermark(self.engine, self.ticker)
+        if watermark is None or not table.target().exists():
+            return None
+        (anchor,) = self.engine.execute(
+            *table.select("MAX(Date)", "pct_change IS NOT NULL")
+        ).fetchone()
+        if anchor is None:
+            return None
+        # rows from the last trading day or the last tweet date on change:
+        # interpolation, pct_change and the sentiment fill cross them
+        anchor, watermark = pd.Timestamp(anchor), pd.Timestamp(watermark)
+        start = min(anchor, watermark)
+        seed = self.engine.execute(
+            *table.select(
+                "sentiment",
+                "Date < ? AND sentiment IS NOT NULL",
+                (sql_date(start),),
+                " ORDER BY Date DESC LIMIT 1",
+            )
+        ).fetchone()
+        if seed is None:
+            return None
+        stored = table.read(
+            where="Date >= ?", params=(sql_date(start),), parse_dates=["Date"]
+        )
+        return start, stored, seed[0], anchor, watermark
 
     def run(self):
-        data = list(
-            dask.compute(
+        restart = self.restart() if self.incremental else None
+        if restart is None:
+            data = compute_graph(
                 twitter_finance(
-                    self.input()["finance"].path, self.input()["twitter"].path
+                    self.input()["finance"].path,
+                    self.input()["twitter"].path,
+                    self.sentiment_cache,
+                    self.sentiment_workers,
+                    self.sentiment_chunk_size,
+                    (self.twitter_start, self.twitter_end),
                 )
             )
-        )[0]
-        data.to_sql(self.ticker, con=self.engine, if_exists="replace", index=False)
+            with self.engine.begin() as con:
+                self.table().write(con, data)
+                set_watermark(con, self.ticker, self.twitter_end)
+                self.table().target(self.fingerprint).record(con)
+            return
+
+        start, stored, seed, anchor, watermark = restart
+        data = compute_graph(
+            extend(
+                stored,
+                seed,
+                clean_finance(self.input()["finance"].path, anchor),
+                clean_twitter(
+                    self.input()["twitter"].path,
+                    self.sentiment_cache,
+                    self.sentiment_workers,
+                    self.sentiment_chunk_size,
+                    (watermark + pd.Timedelta(days=1), self.twitter_end),
+                ),
+                anchor,
+                watermark,
+            )
+        )
+        table = self.table()
+        with self.engine.begin() as con:
+            table.delete(con, "Date >= ?", (sql_date(start),))
+            table.write(con, data, replace=False)
+            set_watermark(con, self.ticker, max(watermark.date(), self.twitter_end))
+            table.target(self.fingerprint).record(con)
+
+
+class ExtractAlltoDB(Task):
+    """
+    Clean data of many tickers in one dask graph and save each to database.
+    Finance and twitter cleaning of all tickers share one scheduler, instead
+    of one ExtracttoDB at a time.
+    """
+
+    engine = get_engine()
+    sentiment_cache = ExtracttoDB.sentiment_cache
+    tickers = ListParameter()
+    twitter_start = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[0]).date())
+    twitter_end = DateParameter(default=pd.Timestamp(TWITTER_WINDOW[1]).date())
+    scheduler = ChoiceParameter(
+        choices=["threads", "processes", "distributed", "sync"],
+        default="threads",
+        significant=False,
+    )
+    # 0 leaves the number of dask workers to dask
+    num_workers = IntParameter(default=0, significant=False)
+    sentiment_workers = IntParameter(default=1, significant=False)
+    sentiment_chunk_size = IntParameter(default=20000, significant=False)
+
+    def requires(self):
+        return {ticker: ExtracttoDB(ticker).requires() for ticker in self.tickers}
+
+    def fingerprint(self, ticker):
+        """
+        Fingerprint ExtracttoDB records for the table of ticker
+        """
+        task = ExtracttoDB(
+            ticker, twitter_start=self.twitter_start, twitter_end=self.twitter_end
+        )
+        return task.fingerprint(self.requires()[ticker])
+
+    def output(self):
+        # tickers whose inputs did not change are left as they are
+        return {
+            ticker: TickerTable(ticker, self.engine).target(
+                partial(self.fingerprint, ticker)
+            )
+            for ticker in self.tickers
+        }
+
+    def run(self):
+        outputs = self.output()
+        todo = [ticker for ticker, table in outputs.items() if not table.exists()]
+        graph = {
+            ticker: twitter_finance(
+                self.input()[ticker]["finance"].path,
+                self.input()[ticker]["twitter"].path,
+                self.sentiment_cache,
+                self.sentiment_workers,
+                self.sentiment_chunk_size,
+                (self.twitter_start, self.twitter_end),
+            )
+            for ticker in todo
+        }
+        data = compute_graph(graph, self.scheduler, self.num_workers or None)
+        # all tickers are stored in one transaction
+        with self.engine.begin() as con:
+            for ticker, frame in data.items():
+                TickerTable(ticker, con).write(con, frame)
+                set_watermark(con, ticker, self.twitter_end)
+                outputs[ticker].record(con)
@@ -1,12 +1,19 @@
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.middleware.http import ConditionalGetMiddleware
 from django.shortcuts import render
+from django.utils.decorators import decorator_from_middleware
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 import json
-from luigi import build
+import time
 from .wrapper_tasks import LoadAllData
-from .analyze_tasks import Predict
-from .graph import graph
-from .reddit_post import post
+from .analyze_tasks import Predict, get_prediction, predictions_json
+from .jobs import get_jobs
+from .graph import batch_json, graph_payload
+from .reddit_post import Share
+
+# ETag of the response body, and 304 to a GET whose If-None-Match matches it
+condition_get = decorator_from_middleware(ConditionalGetMiddleware)
 
 
 @csrf_exempt
@@ -29,13 +36,56 @@ def my_page(request):
     return render(request, "index.html", context)
 
 
+def accepted(job):
+    """
+    Response to a request whose build runs as a background job
+    """
+    return JsonResponse(
+        {"job": job, "url": "/twitter_stock/jobs/{}/".format(job)}, status=202
+    )
+
+
 @csrf_exempt
 def loadingData(request):
     """
-    Load data into database.
+    Load data into database, in the background.
+    """
+    return accepted(get_jobs().submit([LoadAllData("all")]))
+
+
+def jobs(request, job):
+    """
+    Status, per-task progress and timing of a background job.
+    """
+    status = get_jobs().status(job)
+    if status is None:
+        return JsonResponse({"error": "unknown job"}, status=404)
+    return JsonResponse(status)
+
+
+def job_events(request, job):
+    """
+    Server-sent events of the tasks of a background job as they happen:
+    scheduled, complete, missing, started, succeeded, failed and duration.
     """
-    build([LoadAllData("all")], local_scheduler=True)
-    return HttpResponse()
+    queue = get_jobs()
+    if not queue.owns(job):
+        # the events stay in the server process running the job
+        return JsonResponse({"error": "unknown job"}, status=404)
+
+    def stream():
+        for event in queue.follow(job, keepalive=15):
+            if event is None:
+                # a comment keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+            else:
+                yield "event: {}\ndata: {}\n\n".format(
+                    event["event"], json.dumps(event)
+                )
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    return response
 
 
 @csrf_exempt
@@ -63,17 +113,50 @@ def predict(request):
 
     else:
         ticker = ticker.lower()
-        build([Predict(ticker, myDate)], local_scheduler=True)
-        myResult = Predict(ticker, myDate).get_result()
+        myResult = get_prediction(ticker, myDate)
+        if myResult is None:
+            # not predicted yet, Predict may have to train the model first
+            return accepted(get_jobs().submit([Predict(ticker, myDate)]))
         return HttpResponse(myResult)
 
 
 @csrf_exempt
+@gzip_page
+@condition_get
+def predictions(request):
+    """
+    Stored predictions of many tickers over a date range, by GET or POST of
+    tickers separated by commas, start and end. Never starts a job: tickers
+    whose model is not trained yet come back as missing.
+    """
+    params = request.GET if request.method == "GET" else request.POST
+    tickers = [t.strip().lower() for t in params.get("tickers", "").split(",")]
+    tickers = list(dict.fromkeys(t for t in tickers if t))
+    if not tickers or "start" not in params or "end" not in params:
+        return JsonResponse({"error": "tickers, start and end needed"}, status=400)
+    start = time.perf_counter()
+    try:
+        myResult = predictions_json(tickers, params["start"], params["end"])
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+    response = HttpResponse(myResult, content_type="application/json")
+    response["Server-Timing"] = "predict;dur={:.2f}".format(
+        (time.perf_counter() - start) * 1000
+    )
+    return response
+
+
+@csrf_exempt
+@gzip_page
+@condition_get
 def mygraph(request):
     """
-    Graph of comparisons by user's input on ticker.
+    Graph of comparisons by user's input on ticker, by GET or POST. points
+    downsamples the curves to that many points, format=binary encodes them
+    as in graph.graph_payload.
     """
-    ticker = request.POST["ticker"]
+    params = request.GET if request.method == "GET" else request.POST
+    ticker = params["ticker"]
 
     context = {}
     context["information"] = (
@@ -91,17 +174,47 @@ def mygraph(request):
         return render(request, "", context)
     else:
         ticker = ticker.lower()
-        myDate, nav, nav_strategy = graph(ticker)
-        myResult = json.dumps(
-            {"date": myDate, "nav": nav, "nav_strategy": nav_strategy}
+        start = time.perf_counter()
+        try:
+            points = params.get("points")
+            points = None if points is None else int(points)
+            myResult, content_type = graph_payload(
+                ticker, points, params.get("format", "json")
+            )
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+        response = HttpResponse(myResult, content_type=content_type)
+        response["Server-Timing"] = "graph;dur={:.2f}".format(
+            (time.perf_counter() - start) * 1000
         )
-        return HttpResponse(myResult)
+        return response
+
+
+@csrf_exempt
+@gzip_page
+@condition_get
+def mygraphs(request):
+    """
+    Graphs of many tickers to compare, by GET or POST of tickers separated
+    by commas, aligned on their dates in one response.
+    """
+    params = request.GET if request.method == "GET" else request.POST
+    tickers = [t.strip().lower() for t in params.get("tickers", "").split(",")]
+    tickers = list(dict.fromkeys(t for t in tickers if t))
+    if not tickers:
+        return JsonResponse({"error": "no tickers"}, status=400)
+    start = time.perf_counter()
+    response = HttpResponse(batch_json(tickers), content_type="application/json")
+    response["Server-Timing"] = "graph;dur={:.2f}".format(
+        (time.perf_counter() - start) * 1000
+    )
+    return response
 
 
 @csrf_exempt
 def share(request):
     """
-    Share the prediction result by posting to Reddit.
+    Share the prediction result by posting to Reddit, in the background.
     """
     request.encoding = "utf-8"
 
@@ -125,8 +238,4 @@ def share(request):
 
     else:
         ticker = ticker.lower()
-        myFlag = post(ticker, myDate)
-        if myFlag:
-            return HttpResponse("Posted to Reddit!")
-        else:
-            return HttpResponse("Limited! Please try again later!")
+        return accepted(get_jobs().submit([Share(ticker, myDate)]))
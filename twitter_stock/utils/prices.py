@@ -0,0 +1,63 @@
+import pandas as pd
+import yfinance as yf
+
+# dates of prices we need to align with all stock tickers
+FINANCE_WINDOW = ("2016-04-01", "2016-06-17")
+
+
+def yahoo_download(tickers, start, end, threads):
+    """
+    One yfinance call for a batch of tickers, columns grouped by ticker.
+    yfinance fetches the tickers of the call over at most `threads` threads.
+    """
+    return yf.download(
+        list(tickers),
+        start=start,
+        end=end,
+        group_by="ticker",
+        threads=threads,
+        progress=False,
+    )
+
+
+def split_prices(data, tickers):
+    """
+    Split a batch download into {ticker: frame}, each frame shaped like a
+    single ticker download after reset_index. Tickers without any price
+    are left out.
+    """
+    if not isinstance(data.columns, pd.MultiIndex):
+        # a batch of one ticker comes back with flat columns
+        data = pd.concat({tickers[0]: data}, axis=1)
+    columns = {str(name).lower(): name for name in data.columns.get_level_values(0)}
+    out = {}
+    for ticker in tickers:
+        if ticker.lower() not in columns:
+            continue
+        frame = data[columns[ticker.lower()]].dropna(how="all")
+        if frame.empty:
+            continue
+        frame.columns.name = None
+        out[ticker] = frame.reset_index()
+    return out
+
+
+def download_prices(
+    tickers,
+    window=FINANCE_WINDOW,
+    batch_size=100,
+    threads=16,
+    download=yahoo_download,
+):
+    """
+    Prices of many tickers in batched calls of at most batch_size tickers,
+    with at most `threads` requests in flight.
+    download: provider with the signature of yahoo_download, e.g. a fixture
+    """
+    tickers = list(tickers)
+    out = {}
+    for i in range(0, len(tickers), batch_size):
+        batch = tickers[i : i + batch_size]
+        data = download(batch, window[0], window[1], min(threads, len(batch)))
+        out.update(split_prices(data, batch))
+    return out
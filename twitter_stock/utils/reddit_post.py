@@ -1,7 +1,7 @@
 import praw
 import os
-from .analyze_tasks import Predict
-from luigi import build
+from luigi import Parameter, Task
+from .analyze_tasks import Predict, get_prediction
 
 # establish API
 reddit = praw.Reddit(
@@ -18,15 +18,35 @@ def post(ticker, date):
     Post prediction result to reddit
     """
 
-    build([Predict(ticker=ticker, date=date)], local_scheduler=True)
+    text = get_prediction(ticker, date)
     subreddit = reddit.subreddit("prediction")
     try:
         subreddit.submit(
             title="Stock Prediction by Twitter Sentiment",
-            selftext=Predict(ticker=ticker, date=date).get_result(),
+            selftext=text,
         )
         return True
 
     except praw.exceptions.RedditAPIException as e:
         print(e.message)
         return False
+
+
+class Share(Task):
+    """
+    Post the prediction of ticker on date to reddit, predicting it first.
+    """
+
+    ticker = Parameter()
+    date = Parameter()
+
+    def requires(self):
+        return Predict(ticker=self.ticker, date=self.date)
+
+    def complete(self):
+        # posted again on every share
+        return False
+
+    def run(self):
+        if not post(self.ticker, self.date):
+            raise RuntimeError("Limited! Please try again later!")
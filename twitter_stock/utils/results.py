@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+from luigi import Config, Target
+from luigi.parameter import FloatParameter, IntParameter
+
+
+class predict_results(Config):
+    """
+    [predict_results] section of luigi.cfg
+    """
+
+    # seconds a prediction is kept
+    ttl = FloatParameter(default=24 * 3600.0)
+    # entries of the in-process LRU in front of the Django cache
+    max_size = IntParameter(default=10000)
+
+
+def django_cache():
+    """
+    Default cache of the Django settings, or a private in-memory one when
+    the tasks run outside of Django
+    """
+    from django.core.cache.backends.locmem import LocMemCache
+    from django.core.exceptions import ImproperlyConfigured
+
+    try:
+        from django.core.cache import caches
+
+        return caches["default"]
+    except ImproperlyConfigured:
+        return LocMemCache("predict_results", {"TIMEOUT": None})
+
+
+class ResultStore:
+    """
+    Prediction results keyed by (ticker, date), each entry expiring after
+    ttl seconds. An in-process LRU answers repeated reads, the Django cache
+    shares results between threads and server processes. Safe to use from
+    concurrent threads.
+    """
+
+    def __init__(self, ttl=None, max_size=None, cache=None):
+        config = predict_results()
+        self.ttl = config.ttl if ttl is None else ttl
+        self.max_size = config.max_size if max_size is None else max_size
+        self._cache = cache
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        # resolved on first use, Django may not be set up at import time
+        if self._cache is None:
+            self._cache = django_cache()
+        return self._cache
+
+    def _key(self, ticker, date):
+        # retraining a ticker bumps its generation, which retires its results
+        generation = self.cache.get("predict:{}".format(ticker), 0)
+        day = pd.Timestamp(date).date().isoformat()
+        return "predict:{}:{}:{}".format(ticker, generation, day)
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def get(self, ticker, date):
+        """
+        Stored result of ticker on date, None if missing or expired
+        """
+        key = self._key(ticker, date)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._memory.pop(key, None)
+        entry = self.cache.get(key)
+        if entry is None or entry[0] <= now:
+            with self._lock:
+                self.misses += 1
+            return None
+        self._remember(key, entry)
+        with self._lock:
+            self.hits += 1
+        return entry[1]
+
+    def put(self, ticker, date, result):
+        """
+        Store the result of ticker on date for ttl seconds
+        """
+        key = self._key(ticker, date)
+        entry = (time.time() + self.ttl, result)
+        self.cache.set(key, entry, timeout=self.ttl)
+        self._remember(key, entry)
+
+    def invalidate(self, ticker):
+        """
+        Retire every stored result of ticker
+        """
+        key = "predict:{}".format(ticker)
+        self.cache.add(key, 0, timeout=None)
+        self.cache.incr(key)
+        with self._lock:
+            for stale in [k for k in self._memory if k.startswith(key + ":")]:
+                del self._memory[stale]
+
+
+class ResultTarget(Target):
+    """
+    Luigi target of one (ticker, date) entry of a ResultStore
+    """
+
+    def __init__(self, store: ResultStore, ticker: str, date: str):
+        super().__init__()
+        self.store = store
+        self.ticker = ticker
+        self.date = date
+
+    def exists(self):
+        return self.store.get(self.ticker, self.date) is not None
+
+    def read(self):
+        return self.store.get(self.ticker, self.date)
+
+    def write(self, result):
+        self.store.put(self.ticker, self.date, result)
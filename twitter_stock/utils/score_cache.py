@@ -0,0 +1,132 @@
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+
+def text_hash(text: str) -> int:
+    """
+    Key of a tweet in the cache: the first 64 bits of its sha1, which fit
+    sqlite's integer rowid
+    """
+    digest = hashlib.sha1(text.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+class SentimentCache:
+    """
+    On-disk SQLite cache of tweet text hash -> compound score.
+    Entries are tagged with the analyzer version (a score from another
+    version is a miss), and the least recently used entries are evicted
+    once the cache grows past max_size.
+    """
+
+    def __init__(self, path: str, version: str, max_size: int = 1000000):
+        self.path = path
+        self.version = version
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as con, con:
+            con.execute("""CREATE TABLE IF NOT EXISTS scores (
+                       hash INTEGER PRIMARY KEY,
+                       version TEXT NOT NULL,
+                       score REAL NOT NULL,
+                       last_used INTEGER NOT NULL)""")
+            con.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+            )
+            con.execute("""CREATE TABLE IF NOT EXISTS counters (
+                       name TEXT PRIMARY KEY, value INTEGER NOT NULL)""")
+
+    def _connect(self):
+        # one connection per call, so the cache can be shared by dask threads.
+        # Transactions take the write lock when they begin: get_many reads
+        # then writes, and a read lock upgraded while another process
+        # writes fails at once instead of waiting for the timeout
+        con = sqlite3.connect(self.path, timeout=60, isolation_level="IMMEDIATE")
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA synchronous = NORMAL")
+        return con
+
+    def get_many(self, hashes):
+        """
+        Return {hash: score} for the hashes found, and mark them as used
+        """
+        hashes = list(hashes)
+        now = time.time_ns()
+        with closing(self._connect()) as con, con:
+            # join against a temp table instead of one lookup per tweet
+            con.execute("CREATE TEMP TABLE wanted (hash INTEGER PRIMARY KEY)")
+            con.executemany(
+                "INSERT OR IGNORE INTO wanted VALUES (?)", ((int(h),) for h in hashes)
+            )
+            found = dict(
+                con.execute(
+                    """SELECT hash, score FROM scores JOIN wanted USING (hash)
+                       WHERE version = ?""",
+                    (self.version,),
+                ).fetchall()
+            )
+            con.execute(
+                """UPDATE scores SET last_used = ?
+                   WHERE version = ? AND hash IN (SELECT hash FROM wanted)""",
+                (now, self.version),
+            )
+            hits, misses = len(found), len(hashes) - len(found)
+            self._count(con, hits=hits, misses=misses)
+        self.hits += hits
+        self.misses += misses
+        return found
+
+    def put_many(self, scores):
+        """
+        Store {hash: score}, then evict down to max_size
+        """
+        now = time.time_ns()
+        with closing(self._connect()) as con, con:
+            con.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                [(int(h), self.version, float(s), now) for h, s in scores.items()],
+            )
+            (size,) = con.execute("SELECT COUNT(*) FROM scores").fetchone()
+            evicted = max(size - self.max_size, 0)
+            if evicted:
+                con.execute(
+                    """DELETE FROM scores WHERE hash IN (
+                           SELECT hash FROM scores ORDER BY last_used LIMIT ?)""",
+                    (evicted,),
+                )
+                self._count(con, evictions=evicted)
+        self.evictions += evicted
+
+    @staticmethod
+    def _count(con, **counts):
+        con.executemany(
+            """INSERT INTO counters VALUES (?, ?)
+               ON CONFLICT(name) DO UPDATE SET value = value + excluded.value""",
+            counts.items(),
+        )
+
+    def stats(self):
+        """
+        Size of the cache and hit/miss/eviction counters over all runs
+        """
+        with closing(self._connect()) as con:
+            out = dict(con.execute("SELECT name, value FROM counters").fetchall())
+            (out["size"],) = con.execute("SELECT COUNT(*) FROM scores").fetchone()
+        for name in ("hits", "misses", "evictions"):
+            out.setdefault(name, 0)
+        return out
+
+    def clear(self):
+        """
+        Drop every cached score and reset the counters
+        """
+        with closing(self._connect()) as con, con:
+            con.execute("DELETE FROM scores")
+            con.execute("DELETE FROM counters")
+        self.hits = self.misses = self.evictions = 0
@@ -0,0 +1,341 @@
+import hashlib
+import logging
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .score_cache import SentimentCache, text_hash
+from vaderSentiment.vaderSentiment import (
+    SentimentIntensityAnalyzer,
+    SentiText,
+    BOOSTER_DICT,
+    SPECIAL_CASES,
+    NEGATE,
+    C_INCR,
+    N_SCALAR,
+)
+
+logger = logging.getLogger(__name__)
+
+# bump when a change here can change a score, to invalidate cached scores
+SCORER_VERSION = 1
+
+# words the rules look for around a lexicon item
+CONTROL_WORDS = {
+    w: i
+    for i, w in enumerate(
+        ["no", "or", "nor", "never", "so", "this", "without", "doubt", "least"]
+        + ["at", "very", "kind", "of", "but"]
+    )
+}
+
+
+def _char_class(chars):
+    """
+    Build a regex character class of code point ranges (much faster to match
+    than a class listing every character)
+    """
+    points = sorted(ord(c) for c in chars)
+    ranges = []
+    for p in points:
+        if ranges and p == ranges[-1][1] + 1:
+            ranges[-1][1] = p
+        else:
+            ranges.append([p, p])
+    return "[{}]".format(
+        "".join(
+            (
+                re.escape(chr(a))
+                if a == b
+                else "{}-{}".format(re.escape(chr(a)), re.escape(chr(b)))
+            )
+            for a, b in ranges
+        )
+    )
+
+
+class BatchSentimentAnalyzer:
+    """
+    Score a whole column of texts with VADER in one pass.
+    Tokens are looked up once per distinct token, and the booster, negation,
+    idiom, "least" and "but" rules are applied over flat token arrays, so the
+    compound scores match SentimentIntensityAnalyzer.polarity_scores.
+    """
+
+    def __init__(self, analyzer: SentimentIntensityAnalyzer = None):
+        self.analyzer = analyzer or SentimentIntensityAnalyzer()
+        self.lexicon = self.analyzer.lexicon
+        # polarity_scores checks emojis one character at a time
+        self.emojis = {k: v for k, v in self.analyzer.emojis.items() if len(k) == 1}
+        self._emoji_chars = frozenset(self.emojis)
+        self._emoji_re = re.compile(_char_class(self.emojis))
+        self._special = pd.Series(SPECIAL_CASES, dtype=float)
+        self._ngram_boost = pd.Series(
+            {k: v for k, v in BOOSTER_DICT.items() if " " in k}, dtype=float
+        )
+        # the analyzer keeps the raw lexicon files, which pin down its scores
+        lexicons = (
+            self.analyzer.lexicon_full_filepath + self.analyzer.emoji_full_filepath
+        )
+        self.version = "{}-{}".format(
+            SCORER_VERSION, hashlib.sha1(lexicons.encode("utf-8")).hexdigest()[:12]
+        )
+
+    def _replace_emojis(self, text):
+        # same output as the character loop at the top of polarity_scores
+        def describe(match):
+            start = match.start()
+            sep = "" if start == 0 or match.string[start - 1] == " " else " "
+            return sep + self.emojis[match.group()]
+
+        return self._emoji_re.sub(describe, text).strip()
+
+    def _token_table(self, tokens):
+        """
+        Precompute per distinct token everything the rules need
+        """
+        raw = pd.Series(tokens, dtype=object)
+        stripped = raw.map(SentiText._strip_punc_if_word)
+        lower = stripped.str.lower()
+        booster = lower.map(BOOSTER_DICT)
+        return pd.DataFrame(
+            {
+                "lower": lower,
+                "word": lower.map(CONTROL_WORDS).fillna(-1).astype(int),
+                "isupper": stripped.map(str.isupper).astype(bool),
+                "in_lex": lower.isin(self.lexicon.keys()),
+                "valence": lower.map(self.lexicon).fillna(0.0),
+                "is_booster": booster.notnull(),
+                "booster": booster.fillna(0.0),
+                "negated": lower.isin(NEGATE) | lower.str.contains("n't", regex=False),
+            }
+        )
+
+    def _idioms(self, v, rows, lower, nxt1, nxt2, has1, has2, prev):
+        """
+        Vectorized _special_idioms_check for the rows it is reached on
+        """
+        w0 = lower[rows]
+        w1, w2, w3 = (lower[prev[k][rows]] for k in (1, 2, 3))
+        onezero = w1 + " " + w0
+        twoonezero = w2 + " " + onezero
+        twoone = w2 + " " + w1
+        threetwoone = w3 + " " + twoone
+        threetwo = w3 + " " + w2
+        out = v[rows].copy()
+        # first matching sequence wins, so apply them in reverse order
+        for seq in (threetwo, threetwoone, twoone, twoonezero, onezero):
+            hit = self._special.reindex(seq).to_numpy()
+            out = np.where(np.isnan(hit), out, hit)
+        zeroone = w0 + " " + lower[nxt1[rows]]
+        zeroonetwo = zeroone + " " + lower[nxt2[rows]]
+        for seq, valid in ((zeroone, has1[rows]), (zeroonetwo, has2[rows])):
+            hit = self._special.reindex(seq).to_numpy()
+            out = np.where(valid & ~np.isnan(hit), hit, out)
+        for seq in (threetwoone, threetwo, twoone):
+            out = out + self._ngram_boost.reindex(seq).fillna(0.0).to_numpy()
+        v[rows] = out
+
+    def compound(self, texts):
+        """
+        Return the VADER compound score of every text as a NumPy array
+        """
+        # retweets and bot posts repeat, so score each distinct text once
+        codes, uniques = pd.factorize(_texts(texts))
+        if len(uniques) == 0:
+            return np.zeros(len(codes))
+        return self._score(pd.Series(uniques, dtype=object))[codes]
+
+    def _score(self, texts):
+        n = len(texts)
+        has_emoji = ~texts.map(self._emoji_chars.isdisjoint).astype(bool)
+        texts[has_emoji] = texts[has_emoji].map(self._replace_emojis)
+
+        # tokenize everything at once into one flat token array
+        split = texts.str.split()
+        n_tok = split.str.len().to_numpy()
+        flat = split.explode().dropna()
+        text_id = flat.index.to_numpy()
+        codes, uniques = pd.factorize(flat.to_numpy())
+        table = self._token_table(uniques)
+        if len(codes) == 0:
+            return np.zeros(n)
+        lower = table["lower"].to_numpy()[codes]
+        word = table["word"].to_numpy()[codes]
+        isupper = table["isupper"].to_numpy()[codes]
+        in_lex = table["in_lex"].to_numpy()[codes]
+        lex_val = table["valence"].to_numpy()[codes]
+        is_boost = table["is_booster"].to_numpy()[codes]
+        boost = table["booster"].to_numpy()[codes]
+        negated = table["negated"].to_numpy()[codes]
+
+        m = len(codes)
+        idx = np.arange(m)
+        starts = np.concatenate([[0], np.cumsum(n_tok)])[:-1]
+        pos = idx - starts[text_id]
+        length = n_tok[text_id]
+        # neighbour indices; invalid ones are clipped and masked by pos/length
+        prev = {k: np.clip(idx - k, 0, m - 1) for k in (1, 2, 3)}
+        nxt1, nxt2 = np.clip(idx + 1, 0, m - 1), np.clip(idx + 2, 0, m - 1)
+        has1, has2 = pos < length - 1, pos < length - 2
+        allcaps = np.bincount(text_id, weights=isupper, minlength=n)
+        cap_diff = ((allcaps > 0) & (allcaps < n_tok))[text_id]
+
+        def prev_is(k, *words):
+            return (pos >= k) & np.isin(
+                word[prev[k]], [CONTROL_WORDS[w] for w in words]
+            )
+
+        # words that carry their own valence
+        base = (
+            in_lex
+            & ~is_boost
+            & ~(
+                (word == CONTROL_WORDS["kind"])
+                & has1
+                & (word[nxt1] == CONTROL_WORDS["of"])
+            )
+        )
+        v = np.where(base, lex_val, 0.0)
+        v[base & (word == CONTROL_WORDS["no"]) & has1 & in_lex[nxt1]] = 0.0
+        no_before = (
+            prev_is(1, "no")
+            | prev_is(2, "no")
+            | (prev_is(3, "no") & prev_is(1, "or", "nor"))
+        )
+        v = np.where(base & no_before, lex_val * N_SCALAR, v)
+        caps = base & isupper & cap_diff
+        v = np.where(caps, np.where(v > 0, v + C_INCR, v - C_INCR), v)
+
+        # boosters and negations in the three preceding words
+        for start_i, damp in ((0, 1.0), (1, 0.95), (2, 0.9)):
+            j = prev[start_i + 1]
+            rows = base & (pos > start_i) & ~in_lex[j]
+            s = np.where(v < 0, -boost[j], boost[j])
+            s = np.where(
+                is_boost[j] & isupper[j] & cap_diff,
+                np.where(v > 0, s + C_INCR, s - C_INCR),
+                s,
+            )
+            v = np.where(rows, v + s * damp, v)
+            if start_i == 0:
+                neg = negated[j]
+            elif start_i == 1:
+                never = prev_is(2, "never") & prev_is(1, "so", "this")
+                without = prev_is(2, "without") & prev_is(1, "doubt")
+                v = np.where(rows & never, v * 1.25, v)
+                neg = ~never & ~without & negated[j]
+            else:
+                never = (prev_is(3, "never") & prev_is(2, "so", "this")) | prev_is(
+                    1, "so", "this"
+                )
+                without = prev_is(3, "without") & (
+                    prev_is(2, "doubt") | prev_is(1, "doubt")
+                )
+                v = np.where(rows & never, v * 1.25, v)
+                neg = ~never & ~without & negated[j]
+            v = np.where(rows & neg, v * N_SCALAR, v)
+            if start_i == 2 and rows.any():
+                self._idioms(
+                    v, np.flatnonzero(rows), lower, nxt1, nxt2, has1, has2, prev
+                )
+
+        least = base & prev_is(1, "least") & ~in_lex[prev[1]]
+        least &= (pos == 1) | ~prev_is(2, "at", "very")
+        v = np.where(least, v * N_SCALAR, v)
+
+        # "but" keeps the reference implementation's list semantics exactly
+        but_texts = np.unique(text_id[word == CONTROL_WORDS["but"]])
+        for t in but_texts:
+            lo, hi = starts[t], starts[t] + n_tok[t]
+            v[lo:hi] = SentimentIntensityAnalyzer._but_check(
+                list(lower[lo:hi]), list(v[lo:hi])
+            )
+
+        # score_valence
+        sum_s = np.bincount(text_id, weights=v, minlength=n)
+        ep = np.minimum(texts.str.count("!").to_numpy(), 4) * 0.292
+        qm = texts.str.count(r"\?").to_numpy()
+        qm = np.where(qm > 1, np.where(qm <= 3, qm * 0.18, 0.96), 0.0)
+        sum_s = sum_s + np.sign(sum_s) * (ep + qm)
+        compound = np.clip(sum_s / np.sqrt(sum_s * sum_s + 15), -1.0, 1.0)
+        compound[n_tok == 0] = 0.0
+        # round like the builtin round(), which differs from np.round near ties
+        out = np.round(compound, 4)
+        scaled = np.abs(compound) * 1e4
+        ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+        out[ties] = [round(x, 4) for x in compound[ties]]
+        return out
+
+
+def _texts(texts):
+    # a missing tweet (None or NaN) scores as an empty one, factorize would
+    # give it no code of its own
+    return pd.Series(texts, dtype=object).fillna("")
+
+
+# one analyzer per pool process, built once by the pool initializer
+_worker_analyzer = None
+
+
+def _init_worker():
+    global _worker_analyzer
+    _worker_analyzer = BatchSentimentAnalyzer()
+
+
+def _score_chunk(texts):
+    return _worker_analyzer.compound(texts)
+
+
+def parallel_compound(texts, workers, chunk_size=20000):
+    """
+    Score texts in chunks over a process pool, keeping the original order
+    """
+    codes, uniques = pd.factorize(_texts(texts))
+    chunks = [
+        list(uniques[i : i + chunk_size]) for i in range(0, len(uniques), chunk_size)
+    ]
+    if not chunks:
+        return np.zeros(len(codes))
+    # spawn, since we are usually called from a dask worker thread
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as pool:
+        scores = np.concatenate(list(pool.map(_score_chunk, chunks)))
+    return scores[codes]
+
+
+def compound_scores(texts, cache_path=None, workers=1, chunk_size=20000):
+    """
+    Helper function to score a column of tweets in one batch.
+    With a cache_path, only tweets missing from the on-disk cache are scored.
+    With workers > 1, scoring is spread over a process pool.
+    """
+    analyzer = BatchSentimentAnalyzer()
+
+    def score(column):
+        if workers > 1 and len(column) > chunk_size:
+            return parallel_compound(column, workers, chunk_size)
+        return analyzer.compound(column)
+
+    if cache_path is None:
+        return score(texts)
+    cache = SentimentCache(cache_path, analyzer.version)
+    texts = _texts(texts).reset_index(drop=True)
+    hashes = texts.map(text_hash)
+    scores = cache.get_many(hashes.unique())
+    new = hashes[~hashes.isin(list(scores))].drop_duplicates()
+    if len(new):
+        new_scores = dict(zip(new, score(texts[new.index])))
+        cache.put_many(new_scores)
+        scores.update(new_scores)
+    logger.info(
+        "sentiment cache: %d hits, %d misses, %d evicted",
+        cache.hits,
+        cache.misses,
+        cache.evictions,
+    )
+    return hashes.map(scores).to_numpy(dtype=float)
@@ -0,0 +1,205 @@
+import contextlib
+import glob
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+import sklearn
+from sklearn.model_selection import train_test_split
+from sklearn.ensemble import RandomForestClassifier
+
+logger = logging.getLogger(__name__)
+
+# the training window and the days predicted
+TRAIN_END = "2016-05-31"
+PREDICT_WINDOW = ("2016-05-25", "2016-06-16")
+
+# parameters that do not change the fitted model
+RUNTIME_PARAMS = ("n_jobs", "verbose")
+
+
+def model_key(model, x, y):
+    """
+    Hash of the training data, the hyperparameters of model and the versions
+    of the libraries that fit and pickle it
+    """
+    digest = hashlib.sha1()
+    for array in (x, y):
+        array = np.ascontiguousarray(array)
+        digest.update("{}{}".format(array.dtype.str, array.shape).encode())
+        digest.update(array.tobytes())
+    params = {
+        name: value
+        for name, value in model.get_params().items()
+        if name not in RUNTIME_PARAMS
+    }
+    versions = [sklearn.__version__, np.__version__, joblib.__version__]
+    digest.update(json.dumps([params, versions], sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """
+    Fitted models of tickers as joblib artifacts, root/{ticker}/{key}.joblib
+    (see model_key), so a rerun on unchanged data loads the model instead of
+    fitting it. Only the artifact of the last fit of a ticker is kept.
+    report: (hit, seconds to load or fit, bytes on disk) by ticker
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.report = {}
+
+    def path(self, ticker, key):
+        return os.path.join(self.root, ticker, key + ".joblib")
+
+    def load(self, path):
+        """
+        The model stored at path, None when missing or unreadable
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            return joblib.load(path)
+        except FileNotFoundError:
+            # removed since, by the cleanup of another process's fit
+            logger.info("model %s removed while loading, fitted again", path)
+        except Exception:
+            logger.warning("model %s unreadable, fitted again", path, exc_info=True)
+        return None
+
+    def fit(self, ticker, model, x, y):
+        """
+        The model fitted on x, y: loaded when its artifact exists
+        """
+        path = self.path(ticker, model_key(model, x, y))
+        start = time.perf_counter()
+        stored = self.load(path)
+        hit = stored is not None
+        if hit:
+            model = stored.set_params(n_jobs=model.n_jobs)
+        else:
+            model.fit(x, y)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written aside and renamed, so a reader never loads half a file
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            joblib.dump(model, tmp, compress=3)
+            os.replace(tmp, path)
+            for old in glob.glob(os.path.join(self.root, ticker, "*.joblib")):
+                if old != path:
+                    # another process may be removing it too
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(old)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        self.report[ticker] = (hit, time.perf_counter() - start, size)
+        self.log(ticker)
+        return model
+
+    def log(self, ticker):
+        hit, seconds, size = self.report[ticker]
+        logger.info(
+            "model of %s: %s in %.1fms, %d bytes",
+            ticker,
+            "loaded" if hit else "fitted",
+            seconds * 1000,
+            size,
+        )
+
+
+def train_predict(analyze, n_jobs=1, cache=None, ticker=None):
+    """
+    Train the random forest on the cleaned data of a ticker and predict the
+    signals of the predict window, n_jobs trees fitted at a time. With a
+    ModelCache, the model of unchanged data is loaded instead.
+    """
+    # align dates (predict occurs on the next day)
+    analyze = analyze.assign(signal=analyze["signal"].shift(-1, fill_value=0))
+    # splitting data for train and predict
+    train = analyze[analyze["Date"] <= TRAIN_END]
+    predict = analyze[
+        (analyze["Date"] > PREDICT_WINDOW[0]) & (analyze["Date"] < PREDICT_WINDOW[1])
+    ].copy()
+    x_train, x_test, y_train, y_test = train_test_split(
+        np.array(train[["sentiment"]]),
+        np.array(train["signal"]),
+        test_size=0.2,
+        random_state=40,
+    )
+    # train model
+    model = RandomForestClassifier(random_state=40, n_jobs=n_jobs)
+    if cache is None:
+        model.fit(x_train, y_train)
+    else:
+        model = cache.fit(ticker, model, x_train, y_train)
+    predict["signal_predict"] = model.predict(np.array(predict[["sentiment"]]))
+    return predict
+
+
+def _train_reported(frame, n_jobs, cache, ticker):
+    # a pool worker's cache is a copy, so its report goes back with the result
+    predict = train_predict(frame, n_jobs, cache, ticker)
+    return predict, cache and cache.report[ticker]
+
+
+def balance_workers(tickers, workers=0, n_jobs=0, cores=None):
+    """
+    Processes and trees per process for training tickers, so workers x
+    n_jobs does not exceed the cores: 0 picks one given the other, both 0
+    spread the tickers over the cores first
+    """
+    cores = cores or os.cpu_count() or 1
+    if not workers:
+        workers = max(1, min(tickers, cores // max(n_jobs, 1)))
+    if not n_jobs:
+        n_jobs = max(1, cores // workers)
+    if workers * n_jobs > cores:
+        logger.warning(
+            "%d workers x %d jobs oversubscribe %d cores", workers, n_jobs, cores
+        )
+    return workers, n_jobs
+
+
+def train_many(frames, workers=0, n_jobs=0, cache=None):
+    """
+    Predictions of many tickers from their cleaned data {ticker: frame},
+    trained over a process pool balanced with balance_workers, through the
+    ModelCache cache if any
+    """
+    workers, n_jobs = balance_workers(len(frames), workers, n_jobs)
+    start = time.perf_counter()
+    if workers == 1:
+        out = {
+            ticker: train_predict(frame, n_jobs, cache, ticker)
+            for ticker, frame in frames.items()
+        }
+    else:
+        # spawn, so the pool does not fork the threads of a server or luigi
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            futures = {
+                ticker: pool.submit(_train_reported, frame, n_jobs, cache, ticker)
+                for ticker, frame in frames.items()
+            }
+            out = {}
+            for ticker, future in futures.items():
+                out[ticker], report = future.result()
+                if cache is not None:
+                    cache.report[ticker] = report
+                    cache.log(ticker)
+    logger.info(
+        "trained %d tickers with %d workers x %d jobs in %.2fs",
+        len(frames),
+        workers,
+        n_jobs,
+        time.perf_counter() - start,
+    )
+    return out
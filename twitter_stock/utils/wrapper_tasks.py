@@ -10,9 +10,17 @@ class LoadAllData(WrapperTask):
     Wrapper task for loading several or all stock data together
     example usage: LoadAllData(['aapl', 'goog', 'fb'])  #specific stock tickers
                    LoadAllData('all')  #load all data
+                   LoadAllData('all', single_graph=True, scheduler='processes')
+                   #clean all tickers in one dask graph
     """
 
     tickers = Parameter(default="all")
+    single_graph = BoolParameter(default=False, significant=False)
+    scheduler = ChoiceParameter(
+        choices=["threads", "processes", "distributed", "sync"],
+        default="threads",
+        significant=False,
+    )
 
     def __init__(self, *args, **kwargs):
         # override to include parameter
@@ -20,6 +28,11 @@ class LoadAllData(WrapperTask):
 
     def requires(self):
         tickers = allcashtags if self.tickers == "all" else self.tickers
+        if self.single_graph:
+            return ExtractAlltoDB(
+                tickers=[ticker.lower() for ticker in tickers],
+                scheduler=self.scheduler,
+            )
         return [ExtracttoDB(ticker=ticker.lower()) for ticker in tickers]
 
 
@@ -28,8 +41,21 @@ class AnalyzeAll(LoadAllData):  # inherit from LoadAllData
     Wrapper task for analyzing several or all stock data together
     example usage: AnalyzeAll(['aapl', 'goog', 'fb'])  #specific stock tickers
                    Analyze('all')  #load all data
+                   AnalyzeAll('all', parallel=True, workers=4, n_jobs=2)
+                   #train the models over a pool of 4 processes
     """
 
+    parallel = BoolParameter(default=False, significant=False)
+    # 0 balances the processes and the trees fitted by each against the cores
+    workers = IntParameter(default=0, significant=False)
+    n_jobs = IntParameter(default=0, significant=False)
+
     def requires(self):
         tickers = allcashtags if self.tickers == "all" else self.tickers
+        if self.parallel:
+            return TrainAll(
+                tickers=[ticker.lower() for ticker in tickers],
+                workers=self.workers,
+                n_jobs=self.n_jobs,
+            )
         return [Analyze(ticker=ticker.lower()) for ticker in tickers]